@@ -0,0 +1,145 @@
+import os
+import threading
+
+import pygame
+
+from profiler import clock
+
+# clock the rate limits run on, in ms. pygame's own needs pygame.init
+def ticks():
+    return clock() * 1000.0
+
+class Audio:
+    # sound effects and music. the mixer is started and the effects decoded
+    # on a background thread, so the first frame never waits for the sound
+    # card; anything played before that is dropped. effects play on a pool
+    # of reserved channels: a busy pool gives way to the more important
+    # sound, and every effect plays at most once per interval ms.
+    # music is streamed from disk, one track per world, faded out and in
+    # when a door leads to a world with another track
+    def __init__(self, path='misc', channels=8, fade=600):
+        self.path = path
+        self.size = channels
+        self.fade = fade
+
+        self.effects = {} # name -> (file, volume, priority, interval)
+        self.sounds = {} # name -> pygame.mixer.Sound, once ready
+        self.last = {} # name -> ticks it last played
+        self.pool = [] # reserved channels
+        self.playing = [] # (priority, started) of what each channel plays
+
+        self.tracks = {} # world -> music file
+        self.track = None # music file playing
+        self.next = None # music file to start once the current one faded
+        self.switching = False
+
+        self.ready = False
+        self.failed = False
+        self.thread = None
+
+        self.played = 0
+        self.stolen = 0
+        self.limited = 0
+        self.dropped = 0
+
+    def add(self, name, file, volume=1.0, priority=0, interval=80):
+        self.effects[name] = (file, volume, priority, interval)
+
+    def add_music(self, world, file):
+        self.tracks[world] = file
+
+    # starts the mixer, on a thread unless threaded is off
+    def start(self, threaded=True):
+        if self.thread is not None or self.ready:
+            return
+        if threaded:
+            self.thread = threading.Thread(target=self.init)
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            self.init()
+
+    def init(self):
+        try:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+            pygame.mixer.set_num_channels(max(self.size, pygame.mixer.get_num_channels()))
+            # channels Sound.play picks on its own come after the pool
+            pygame.mixer.set_reserved(self.size)
+            sounds = {}
+            for name in self.effects:
+                file, volume, priority, interval = self.effects[name]
+                sounds[name] = pygame.mixer.Sound(os.path.join(self.path, file))
+                sounds[name].set_volume(volume)
+        except (pygame.error, IOError):
+            # no sound card or a broken file, the game plays on silently
+            self.failed = True
+            return
+        self.pool = [pygame.mixer.Channel(i) for i in range(0, self.size)]
+        self.playing = [(0, 0) for i in range(0, self.size)]
+        self.sounds = sounds
+        self.ready = True
+
+    def play(self, name):
+        if not self.ready:
+            self.dropped += 1
+            return
+        file, volume, priority, interval = self.effects[name]
+        now = ticks()
+        if name in self.last and now - self.last[name] < interval:
+            self.limited += 1
+            return
+        i = self.channel(priority)
+        if i is None:
+            self.dropped += 1
+            return
+        self.last[name] = now
+        self.pool[i].play(self.sounds[name])
+        self.playing[i] = (priority, now)
+        self.played += 1
+
+    # a free channel, or else the one playing the least important sound
+    # (the oldest of those) if it isn't more important than priority
+    def channel(self, priority):
+        lowest = None
+        for i in range(0, len(self.pool)):
+            if not self.pool[i].get_busy():
+                return i
+            if lowest is None or self.playing[i] < self.playing[lowest]:
+                lowest = i
+        if lowest is None or self.playing[lowest][0] > priority:
+            return None
+        self.stolen += 1
+        return lowest
+
+    # the player entered world, its track takes over once the old one faded
+    def enter(self, world):
+        track = self.tracks.get(world)
+        if track == (self.next if self.switching else self.track):
+            return
+        self.next = track
+        self.switching = True
+        if self.ready and pygame.mixer.music.get_busy():
+            pygame.mixer.music.fadeout(self.fade)
+
+    # once a frame: starts the next track when the old one is gone
+    def update(self):
+        if not self.ready or not self.switching or pygame.mixer.music.get_busy():
+            return
+        self.switching = False
+        self.track = self.next
+        if self.track is None:
+            return
+        try:
+            pygame.mixer.music.load(os.path.join(self.path, self.track))
+            try:
+                pygame.mixer.music.play(-1, 0.0, self.fade)
+            except TypeError:
+                pygame.mixer.music.play(-1) # pygame 1.9 can't fade in
+        except pygame.error:
+            self.track = None
+
+    def stats(self):
+        return {'ready': self.ready, 'failed': self.failed, 'played': self.played,
+                'stolen': self.stolen, 'limited': self.limited, 'dropped': self.dropped,
+                'track': self.track}
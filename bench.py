@@ -0,0 +1,150 @@
+from __future__ import print_function
+
+import sys
+import time
+import json
+import random
+import platform
+import argparse
+
+import pygame
+
+import main
+import sim
+import replay
+
+# views each synthetic world is split into
+LOCS = 5
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    def at(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+    return {'n': len(samples), 'mean': sum(samples) / len(samples),
+            'p50': at(0.50), 'p95': at(0.95), 'p99': at(0.99), 'max': samples[-1]}
+
+def timed(f, *args):
+    start = time.time()
+    result = f(*args)
+    return result, time.time() - start
+
+# a game with the shipped level, timed from a cold asset cache
+def setup():
+    main.assets.clear()
+    game = main.Game()
+    game.setup()
+    return game
+
+# copies the shipped objects scale times over, spread across new views so
+# every view holds about as many objects as the shipped ones do
+def populate(game, scale):
+    templates = list(game.objects)
+    views = sorted(set(obj.view for obj in templates))
+    backgrounds = [game.bg.files[view] for view in views]
+
+    count = len(templates) * (scale - 1)
+    nviews = len(views) * (scale - 1)
+    first = len(game.restr)
+    for w in range(first, first + (nviews + LOCS - 1) // LOCS):
+        game.setup_images(w, LOCS, [backgrounds[(w * LOCS + l) % len(backgrounds)] for l in range(0, LOCS)])
+        for l in range(0, LOCS):
+            game.add_restr(w, l, top=200)
+    synthetic = [(w, l) for w in range(first, len(game.restr)) for l in range(0, LOCS)]
+
+    rng = random.Random(scale)
+    for i in range(0, count):
+        t = templates[i % len(templates)]
+        obj = main.Object('%s_%d' % (t.name, i), t.file, t.width, t.height)
+        obj.set_pos(t.rect.x, t.rect.y)
+        view = synthetic[(i // len(templates)) * len(views) + views.index(t.view)]
+        obj.set_view(*view)
+        # copied pickups have no inventory icon of their own
+        if t.type == 'door':
+            obj.set_type('door', rng.choice(synthetic))
+        elif t.type == 'pickup':
+            obj.set_type('use')
+        else:
+            obj.set_type(t.type)
+        for anim in t.frames:
+            if anim != 'idle':
+                obj.setup_frames(anim, 1, len(t.frames[anim]))
+        obj.set_messages(t.message, t.error, t.response)
+        game.objects.add(obj, game.objects.keys[t][0])
+    return count
+
+# walks right through the views, jumping to a random one every second
+def frames(game, n, rng):
+    keys = replay.Keys(['right'])
+    views = [(w, l) for w in game.bg for l in range(0, len(game.bg[w]))]
+    step, draw = [], []
+    for i in range(0, n):
+        if i % 60 == 0:
+            game.world, game.loc = rng.choice(views)
+            game.player.set_pos(200, 290)
+        start = time.time()
+        game.step(sim.DT, keys, [])
+        middle = time.time()
+        game.draw()
+        step.append(middle - start)
+        draw.append(time.time() - middle)
+    return step, draw
+
+# a keypress on top of a random object
+def interactions(game, n, rng):
+    samples = []
+    for i in range(0, n):
+        objs = list(game.objects.keys)
+        if not objs:
+            break
+        obj = rng.choice(objs)
+        if obj.view is None:
+            continue
+        game.world, game.loc = obj.view
+        game.player.rect.center = obj.rect.center
+        game.player.timer = 0.0
+        start = time.time()
+        game.interactions.dispatch(game, game.player)
+        samples.append(time.time() - start)
+    return samples
+
+def run(scale, nframes, ninteract):
+    rng = random.Random(0)
+    game, load = timed(setup)
+    count, build = timed(populate, game, scale)
+    objects = len(game.objects)
+    step, draw = frames(game, nframes, rng)
+    latency = interactions(game, ninteract, rng)
+    game.close()
+    return {'scale': scale, 'objects': objects, 'views': sum(game.bg.counts.values()),
+            'setup_s': load, 'startup_s': game.startup, 'populate_s': build,
+            'populate_per_object_s': build / count if count else 0.0,
+            'step_s': percentiles(step), 'draw_s': percentiles(draw),
+            'frame_s': percentiles([a + b for a, b in zip(step, draw)]),
+            'interact_s': percentiles(latency),
+            'assets': main.assets.stats(), 'store': {'objects': len(main.store), 'bytes': main.store.bytes()}, 'backgrounds': game.bg.stats(), 'renderer': game.renderer.stats(), 'text': game.text.stats(), 'memory': game.memory_usage()}
+
+def bench(argv):
+    parser = argparse.ArgumentParser(description='time setup, frames and interactions at scaled object counts')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--interactions', type=int, default=500)
+    parser.add_argument('--out', default='bench.json', help="results file, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    sim.init()
+    results = {'python': platform.python_version(), 'pygame': pygame.version.ver,
+               'platform': platform.platform(), 'time': time.time(),
+               'runs': [run(scale, args.frames, args.interactions) for scale in args.scales]}
+
+    out = json.dumps(results, indent=2, sort_keys=True)
+    if args.out == '-':
+        print(out)
+    else:
+        f = open(args.out, 'w')
+        f.write(out + '\n')
+        f.close()
+
+if __name__=='__main__':
+    bench(sys.argv[1:])
@@ -0,0 +1,250 @@
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import json
+import time
+import zlib
+import shutil
+import struct
+import hashlib
+import argparse
+try:
+    import numpy
+except ImportError:
+    numpy = None # pngs are then only written unfiltered
+
+import pygame
+
+import level
+from resources import Atlas
+
+# runtime assets made ahead of time from assets/, into OUT and nowhere
+# else. every sprite sheet and icon the levels use is trimmed and packed
+# into atlas pages, and backgrounds are stored without alpha when they
+# have no see-through pixels. everything is written as the smallest of a
+# few png encodings, see png, and decodes to the same pixels as the file
+# it was made from. manifest.json records the hash of every file things
+# were made from, so building again only redoes what changed. the game
+# uses what was built from files that are still the same and falls back
+# to assets/ for the rest. the drawings in src/ are still exported to
+# assets/ by hand: rendering them again doesn't give the committed pngs
+OUT = 'build'
+FORMAT = 3
+
+def digest(path):
+    f = open(path, 'rb')
+    data = f.read()
+    f.close()
+    return hashlib.sha1(data).hexdigest()[:16]
+
+def read_manifest(out=OUT):
+    try:
+        f = open(os.path.join(out, 'manifest.json'))
+        manifest = json.load(f)
+        f.close()
+    except (IOError, OSError, ValueError):
+        return None
+    if manifest.get('format') != FORMAT:
+        return None
+    return manifest
+
+# backgrounds of the manifest built from their current file, as
+# filename -> (directory, filename) for Backgrounds.built
+def backgrounds(manifest, path='assets', out=OUT):
+    built = {}
+    if not manifest:
+        return built
+    for name in manifest['backgrounds']:
+        source = manifest['sources'].get(name)
+        try:
+            if source and source['stamp'] == Atlas.stamps(path, [name])[name]:
+                built[name] = (out, manifest['backgrounds'][name])
+        except OSError:
+            pass
+    return built
+
+# the built atlas if it holds every one of names as it is now, else None
+def atlas(manifest, names, path='assets', out=OUT):
+    if not manifest:
+        return None
+    atlas = Atlas()
+    try:
+        stamps = Atlas.stamps(path, names)
+    except OSError:
+        return None
+    if not atlas.restore(os.path.join(out, 'atlas'), stamps):
+        return None
+    return atlas
+
+
+# png files for a surface. pygame's writer filters every row, which costs
+# this game's flat coloured drawings more than it saves, so the rows are
+# left unfiltered or, with numpy, given whichever filter (the same for
+# every row or picked per row) compresses best. all of them decode to the
+# same pixels
+def png(surface):
+    w, h = surface.get_size()
+    mode = 'RGBA' if surface.get_flags() & pygame.SRCALPHA else 'RGB'
+    data = pygame.image.tostring(surface, mode)
+    stride = w * len(mode)
+    best = b''.join(b'\0' + data[y * stride:(y + 1) * stride] for y in range(0, h))
+    if numpy is not None:
+        # a quick compression ranks them about as well as the real one
+        size = len(zlib.compress(best, 1))
+        for rows in filtered(data, h, stride, len(mode)):
+            n = len(zlib.compress(rows, 1))
+            if n < size:
+                best, size = rows, n
+    best = zlib.compress(best, 9)
+    header = struct.pack('>IIBBBBB', w, h, 8, 6 if mode == 'RGBA' else 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', best) + chunk(b'IEND', b'')
+
+def chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+# the rows with each png filter (sub, up, average, paeth) and with the
+# one whose bytes are smallest picked per row
+def filtered(data, h, stride, bpp):
+    raw = numpy.frombuffer(data, numpy.uint8).reshape(h, stride).astype(numpy.int16)
+    left = numpy.zeros_like(raw)
+    left[:, bpp:] = raw[:, :-bpp]
+    up = numpy.zeros_like(raw)
+    up[1:] = raw[:-1]
+    corner = numpy.zeros_like(raw)
+    corner[1:, bpp:] = raw[:-1, :-bpp]
+    p = left + up - corner
+    pa, pb, pc = abs(p - left), abs(p - up), abs(p - corner)
+    paeth = numpy.where((pa <= pb) & (pa <= pc), left, numpy.where(pb <= pc, up, corner))
+    filters = [raw - left, raw - up, raw - (left + up) // 2, raw - paeth]
+    filters = [(f & 0xff).astype(numpy.uint8) for f in filters]
+
+    def rows(kinds, filters):
+        out = numpy.empty((h, stride + 1), numpy.uint8)
+        out[:, 0] = kinds
+        for kind in range(1, 5):
+            picked = kinds == kind
+            out[picked, 1:] = filters[kind - 1][picked]
+        return out.tobytes()
+
+    for kind in range(1, 5):
+        yield rows(numpy.full(h, kind, numpy.uint8), filters)
+    cost = numpy.array([numpy.abs(f.astype(numpy.int8).astype(numpy.int32)).sum(1) for f in filters])
+    yield rows((cost.argmin(0) + 1).astype(numpy.uint8), filters)
+
+def write_png(surface, path):
+    f = open(path + '.tmp', 'wb')
+    f.write(png(surface))
+    f.close()
+    os.rename(path + '.tmp', path)
+
+
+class Build:
+    # one run of the build over the given levels
+    def __init__(self, levels, path='assets', out=OUT, force=False):
+        self.levels = levels
+        self.path = path
+        self.out = out
+        self.old = (not force and read_manifest(out)) or {}
+        for key, empty in [('sources', {}), ('sprites', []), ('backgrounds', {})]:
+            self.old.setdefault(key, empty)
+
+        self.built = []
+        self.kept = []
+
+    def run(self):
+        start = time.time()
+        datas = [level.load(path, self.path) for path in self.levels]
+
+        sprites, views = set(), set()
+        for data in datas:
+            sprites.update(level.images(data))
+            views.update('bg_%d_%d.png' % view for view in level.views(data))
+        sprites, views = sorted(sprites), sorted(views)
+
+        sources = {}
+        for name in sprites + views:
+            sources[name] = {'hash': digest(os.path.join(self.path, name)),
+                             'stamp': Atlas.stamps(self.path, [name])[name]}
+        changed = set(name for name in sources if self.old['sources'].get(name, {}).get('hash') != sources[name]['hash'])
+
+        if not os.path.isdir(self.out):
+            os.makedirs(self.out)
+        self.pack(sprites, changed)
+        built = {}
+        for name in views:
+            built[name] = self.background(name, name in changed)
+
+        manifest = {'format': FORMAT, 'sources': sources, 'sprites': sprites, 'backgrounds': built}
+        f = open(os.path.join(self.out, 'manifest.json.tmp'), 'w')
+        json.dump(manifest, f, indent=1, sort_keys=True)
+        f.close()
+        os.rename(os.path.join(self.out, 'manifest.json.tmp'), os.path.join(self.out, 'manifest.json'))
+
+        return {'out': self.out, 'built': self.built, 'kept': len(self.kept),
+                'source_bytes': sum(os.path.getsize(os.path.join(self.path, name)) for name in sources),
+                'built_bytes': sum(os.path.getsize(f) for f in glob.glob(os.path.join(self.out, '*', '*.png')) +
+                                   glob.glob(os.path.join(self.out, '*.png'))),
+                'seconds': time.time() - start}
+
+    # packing depends on every sheet, so the pages are made again when any
+    # of them changed. files that were only touched just get new stamps
+    def pack(self, sprites, changed):
+        out = os.path.join(self.out, 'atlas')
+        stamps = Atlas.stamps(self.path, sprites)
+        index = os.path.join(out, 'index.json')
+        if sprites == self.old['sprites'] and not changed.intersection(sprites) and os.path.exists(index):
+            f = open(index)
+            data = json.load(f)
+            f.close()
+            if data.get('format') == Atlas.FORMAT:
+                data['stamps'] = stamps
+                f = open(index, 'w')
+                json.dump(data, f)
+                f.close()
+                self.kept.extend(sprites)
+                return
+        if os.path.isdir(out):
+            shutil.rmtree(out)
+        atlas = Atlas().build(self.path, sprites)
+        atlas.save(out, stamps)
+        for i in range(0, len(atlas.pages)):
+            write_png(atlas.pages[i], os.path.join(out, 'page_%d.png' % i))
+        self.built.append('atlas')
+
+    # the file a background is decoded from at runtime, made again if the
+    # source changed or the output went missing. one that comes out no
+    # smaller than its source is copied
+    def background(self, name, changed):
+        built = self.old['backgrounds'].get(name)
+        if not changed and built and os.path.exists(os.path.join(self.out, built)):
+            self.kept.append(name)
+            return built
+        surface = pygame.image.load(os.path.join(self.path, name))
+        w, h = surface.get_size()
+        if surface.get_flags() & pygame.SRCALPHA and pygame.mask.from_surface(surface, 254).count() == w * h:
+            opaque = pygame.Surface((w, h), 0, 24)
+            opaque.blit(surface, (0, 0))
+            surface = opaque
+        write_png(surface, os.path.join(self.out, name))
+        if os.path.getsize(os.path.join(self.out, name)) >= os.path.getsize(os.path.join(self.path, name)):
+            shutil.copyfile(os.path.join(self.path, name), os.path.join(self.out, name))
+        self.built.append(name)
+        return name
+
+
+def run(argv):
+    parser = argparse.ArgumentParser(description='build the runtime assets the levels use')
+    parser.add_argument('levels', nargs='*', help='levels to build for, every one in levels/ by default')
+    parser.add_argument('--assets', default='assets')
+    parser.add_argument('--out', default=OUT)
+    parser.add_argument('--force', action='store_true', help='build everything again')
+    args = parser.parse_args(argv)
+
+    levels = args.levels or sorted(glob.glob(os.path.join('levels', '*.json')))
+    print(json.dumps(Build(levels, args.assets, args.out, args.force).run(), indent=2, sort_keys=True))
+    return 0
+
+if __name__=='__main__':
+    sys.exit(run(sys.argv[1:]))
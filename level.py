@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import marshal
+
+# levels are json files, see levels/main.json. a parsed and validated copy
+# is kept in marshal form under CACHE, so starting a big level pack again
+# only costs one small read as long as the json hasn't changed. only levels
+# that were valid against the same assets directory are cached
+CACHE = '.cache'
+FORMAT = 2
+
+# where music tracks named by levels live
+MUSIC = 'misc'
+
+TYPES = ['pickup', 'npc', 'toggle', 'door', 'use']
+
+def cache_path(path):
+    name = os.path.abspath(path).replace(os.sep, '_').replace(':', '_')
+    return os.path.join(CACHE, 'levels', name + '.marshal')
+
+# identifies the json a cached copy was made from and the assets it was
+# checked against
+def stamp(path, assets):
+    st = os.stat(path)
+    return [FORMAT, list(sys.version_info[:2]), st.st_mtime, st.st_size, os.path.abspath(assets)]
+
+def load(path, assets='assets', cache=True):
+    if cache:
+        data = read_cache(path, assets)
+        if data is not None:
+            return data
+
+    f = open(path)
+    data = json.load(f)
+    f.close()
+
+    problems = validate(data, assets)
+    if problems:
+        raise ValueError('%s:\n%s' % (path, '\n'.join(problems)))
+
+    if cache:
+        write_cache(path, data, assets)
+    return data
+
+def read_cache(path, assets):
+    try:
+        f = open(cache_path(path), 'rb')
+        key, data = marshal.loads(f.read())
+        f.close()
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+    if key != stamp(path, assets):
+        return None
+    return data
+
+def write_cache(path, data, assets):
+    out = cache_path(path)
+    try:
+        if not os.path.isdir(os.path.dirname(out)):
+            os.makedirs(os.path.dirname(out))
+        f = open(out + '.tmp', 'wb')
+        f.write(marshal.dumps((stamp(path, assets), data)))
+        f.close()
+        os.rename(out + '.tmp', out)
+    except (IOError, OSError):
+        pass # the cache is only an optimization
+
+# every sprite sheet and inventory icon the level draws
+def images(data):
+    names = set([data['player']['image']])
+    for spec in data['objects']:
+        names.add(spec['image'])
+        if spec['type'] == 'pickup':
+            names.add(spec['name'] + '_inv.png')
+    for swap in data.get('swaps', ()):
+        for item in swap['to']:
+            names.add(item + '_inv.png')
+    return sorted(names)
+
+def views(data):
+    return set((w, l) for w in range(0, len(data['worlds'])) for l in range(0, data['worlds'][w]))
+
+# returns a list of problems with the level, empty if it can be built.
+# the puzzle chain itself is checked by ObjectIndex.validate once built
+def validate(data, assets='assets'):
+    problems = []
+    for key in ('start', 'player', 'worlds', 'objects'):
+        if key not in data:
+            problems.append('missing %s' % key)
+    if problems:
+        return problems
+
+    def exists(name):
+        return os.path.exists(os.path.join(assets, name))
+
+    known = views(data)
+    if tuple(data['start']) not in known:
+        problems.append('start view %s does not exist' % (data['start'],))
+
+    for w in range(0, len(data['worlds'])):
+        for l in range(0, data['worlds'][w]):
+            if not exists('bg_%d_%d.png' % (w, l)):
+                problems.append('world %d has no background bg_%d_%d.png' % (w, w, l))
+
+    for restr in data.get('restrictions', ()):
+        if tuple(restr['view']) not in known:
+            problems.append('restriction for missing view %s' % (restr['view'],))
+
+    music = data.get('music')
+    if isinstance(music, list) and len(music) != len(data['worlds']):
+        problems.append('music has %d tracks for %d worlds' % (len(music), len(data['worlds'])))
+    for track in (music if isinstance(music, list) else [music]):
+        if track and not os.path.exists(os.path.join(MUSIC, track)):
+            problems.append('music track %s does not exist' % track)
+
+    if not exists(data['player']['image']):
+        problems.append('player image %s does not exist' % data['player']['image'])
+
+    names = set()
+    items = set()
+    for spec in data['objects']:
+        name = spec.get('name')
+        for key in ('name', 'image', 'size', 'pos', 'view', 'type'):
+            if key not in spec:
+                problems.append('%s has no %s' % (name or 'object', key))
+        if name in names:
+            problems.append('%s is defined twice' % name)
+        names.add(name)
+        if 'image' in spec and not exists(spec['image']):
+            problems.append('%s: image %s does not exist' % (name, spec['image']))
+        if 'view' in spec and tuple(spec['view']) not in known:
+            problems.append('%s: view %s does not exist' % (name, spec['view']))
+        if spec.get('type') not in TYPES:
+            problems.append('%s: unknown type %r' % (name, spec.get('type')))
+        if spec.get('type') == 'door':
+            if 'to' not in spec or tuple(spec['to']) not in known:
+                problems.append('%s: door leads to missing view %s' % (name, spec.get('to')))
+        if spec.get('type') == 'pickup':
+            items.add(name)
+
+    swaps = set()
+    for swap in data.get('swaps', ()):
+        if swap['at'] not in names:
+            problems.append('swap at missing object %s' % swap['at'])
+        # an object fires one swap, see Player.check_swaps
+        if swap['at'] in swaps:
+            problems.append('%s has more than one swap' % swap['at'])
+        swaps.add(swap['at'])
+        items.update(swap['to'])
+
+    for item in sorted(items):
+        if not exists(item + '_inv.png'):
+            problems.append('%s has no inventory icon %s_inv.png' % (item, item))
+
+    if 'goal' in data and data['goal'] not in names:
+        problems.append('goal %s is not an object' % data['goal'])
+
+    for spec in data['objects']:
+        for req in spec.get('reqs', ()):
+            if req not in items:
+                problems.append('%s needs %s, which nothing provides' % (spec.get('name'), req))
+        for name in spec.get('unreqs', []) + spec.get('parents', []):
+            if name not in names:
+                problems.append('%s refers to missing object %s' % (spec.get('name'), name))
+
+    return problems
@@ -1,30 +1,57 @@
 import sys
 import os
+import json
 
 import pygame
 
-class Object(pygame.sprite.Sprite):
-    def __init__(self, name, image, width, height):
-        pygame.sprite.Sprite.__init__(self)
+from resources import AssetCache, Atlas, Backgrounds, Scaler, TextCache
+from render import DirtyRenderer
+from profiler import Profiler, clock
+from audio import Audio
+from store import ObjectStore
+from memory import Memory
+import replay
+import level
+import build
+
+# shared by every object, so each image file is only loaded once
+assets = AssetCache('assets')
+# state of every object that changes while playing
+store = ObjectStore()
+
+# items that aren't used up when an object requires them
+KEPT = ['balloon', 'milk']
+
+class Object(object):
+    # what changes while playing lives in the store (see store.py), the
+    # rest is set up once from the level. slots instead of a __dict__ keep
+    # big levels small
+    __slots__ = ['name', 'file', 'width', 'height', 'slot', 'frames', 'type', 'uses', 'to',
+                 'reqs', 'unreqs', 'parents', 'message', 'error', 'response', 'breaks',
+                 'index', '__weakref__']
+
+    frametime_max = 10.0
 
-        self.name = name
-        self.image = pygame.image.load(os.path.join('assets', image))
+    def __init__(self, name, image, width, height):
+        self.name = store.intern(name)
+        self.file = store.intern(image)
         self.width = width
         self.height = height
+        self.slot = store.add(self)
+        self.index = None # ObjectIndex this object is registered in
 
         self.rect = pygame.Rect(0,0,width,height)
 
         self.frames = {}
         self.anim = 'idle'
         self.setup_frames('idle', 0, 2)
-        self.frame = 0
-        self.frametime = 0.0
-        self.frametime_max = 10.0
 
-        self.reqs = []
-        self.unreqs = []
-        self.parents = []
+        self.reqs = ()
+        self.unreqs = ()
+        self.parents = ()
         self.type = ''
+        self.uses = 1
+        self.to = None
 
         self.message = ""
         self.error = "" # message when reqs aren't met
@@ -32,99 +59,126 @@ class Object(pygame.sprite.Sprite):
 
         self.breaks = False
 
-        self.view = None # objects are only visible when on a specific view
+    # a new Rect on every read, so changing it in place (rect.x = ...,
+    # move_ip) doesn't move the object. assign a rect or call set_pos,
+    # only its position is taken
+    @property
+    def rect(self):
+        return pygame.Rect(store.x[self.slot], store.y[self.slot], self.width, self.height)
+
+    @rect.setter
+    def rect(self, rect):
+        self.set_pos(rect[0], rect[1])
+
+    # objects are only visible when on a specific view, None is every view
+    @property
+    def view(self):
+        if store.world[self.slot] < 0:
+            return None
+        return (store.world[self.slot], store.loc[self.slot])
+
+    @property
+    def anim(self):
+        return store.names[store.anim[self.slot]]
+
+    @anim.setter
+    def anim(self, name):
+        store.anim[self.slot] = store.anim_id(name)
+        store.count[self.slot] = len(self.frames.get(name, ()))
+
+    @property
+    def frame(self):
+        return store.frame[self.slot]
+
+    @frame.setter
+    def frame(self, frame):
+        store.frame[self.slot] = frame
+
+    @property
+    def frametime(self):
+        return store.frametime[self.slot]
+
+    @frametime.setter
+    def frametime(self, frametime):
+        store.frametime[self.slot] = frametime
 
     def set_pos(self, x, y):
-        self.rect.x = x
-        self.rect.y = y
+        store.x[self.slot] = x
+        store.y[self.slot] = y
+        if self.index:
+            self.index.update(self)
 
     # pickup, npc, toggle, door, use
     def set_type(self, typ, extra=None):
-        self.type = typ
-        if typ == 'pickup':
-            self.uses = 1
+        self.type = store.intern(typ)
         if typ == 'door':
             self.to = extra
 
     def set_view(self, world, loc):
-        self.view = (world, loc)
+        store.world[self.slot] = world
+        store.loc[self.slot] = loc
+        if self.index:
+            self.index.update(self)
 
     def setup_frames(self, anim, row, num):
-        self.frames[anim] = []
-        for i in range(0, num):
-            newframe = self.image.subsurface(i*self.width, row*self.height, self.width, self.height)
-            self.frames[anim].append(newframe)
-
-    def animate(self, dt):
-        # object is animated
-        if len(self.frames) != 0:
-            self.frametime += dt
+        self.frames = store.frame_set(self.frames, anim, assets.frames(self.file, self.width, self.height, row, num))
+        if anim == self.anim:
+            store.count[self.slot] = num
 
-            if self.frametime > self.frametime_max:
-                self.frame = (self.frame + 1) % len(self.frames[self.anim])
-                self.frametime = 0.0
+    def surface(self):
+        return self.frames[self.anim][self.frame]
 
-    def draw(self, display, world, loc):
-        if self.view == None or (self.view[0] == world and self.view[1] == loc):
-            #pygame.draw.rect(display, (200,60,60,20), self.rect)
-            display.blit(self.frames[self.anim][self.frame], self.rect)
+    # the pixels visible in any frame of the current animation
+    def mask(self):
+        return assets.union_mask(self.frames[self.anim])
 
     def set_anim(self, name):
         #self.frame = 0
         #self.frametime = 0
         self.anim = name
+        if self.index:
+            self.index.set_on(self)
 
     def add_req(self, name):
-        self.reqs.append(name)
+        self.reqs += (store.intern(name),)
 
     # object must be grabbed to use this object
     def add_unreq(self, name):
-        self.unreqs.append(name)
+        self.unreqs += (store.intern(name),)
 
     # object must be toggled on to use this object
     def add_parent(self, name):
-        self.parents.append(name)
+        self.parents += (store.intern(name),)
 
     def set_messages(self, message=None, error=None, response=None):
         if message:
-            self.message = message
+            self.message = store.intern(message)
         if error:
-            self.error = error
+            self.error = store.intern(error)
         if response:
-            self.response = response
+            self.response = store.intern(response)
 
-    def can_use(self, player, objects, objects2, objects3):
+    def can_use(self, player, objects):
         r = []
         if self.breaks:
             return False
 
         for req in self.reqs:
-            if req not in player.inventory.keys():
+            if req not in player.inventory:
                 return False
             r.append(req)
 
         for unreq in self.unreqs:
-            for obj in objects:
-                if unreq == obj.name:
-                    return False
+            if objects.present(unreq):
+                return False
 
         for parent in self.parents:
-            for obj in objects:
-                # object is a parent and not toggled on
-                if obj.name == parent and obj.anim == 'idle':
-                    return False
-            for obj in objects2:
-                # object is a parent and not toggled on
-                if obj.name == parent and obj.anim == 'idle':
-                    return False
-            for obj in objects3:
-                # object is a parent and not toggled on
-                if obj.name == parent and obj.anim == 'idle':
-                    return False
-
+            # object is a parent and not toggled on
+            if objects.present(parent) and not objects.is_on(parent):
+                return False
 
         for req in r:
-            if req != 'balloon' and req != 'milk':
+            if req not in KEPT:
                 player.inventory[req]['uses'] -= 1
                 if player.inventory[req]['uses'] <= 0:
                     player.inventory.pop(req)
@@ -139,6 +193,10 @@ class Object(pygame.sprite.Sprite):
 
 
 class Player(Object):
+    # the player moves every tick and changes its rect in place, so it
+    # keeps a real Rect of its own instead of a position in the store
+    rect = None
+
     def __init__(self, name, image, width, height):
         Object.__init__(self, name, image, width, height)
 
@@ -156,6 +214,19 @@ class Player(Object):
         self.timer_max = 10.0
         self.timer = self.timer_max
 
+        # where the player was before the last simulation step
+        self.prev_rect = pygame.Rect(self.rect)
+
+    def set_pos(self, x, y):
+        self.rect.x = x
+        self.rect.y = y
+
+    # where to draw the player, alpha of the way from the last step to this one
+    def lerp(self, alpha):
+        x = self.prev_rect.x + (self.rect.x - self.prev_rect.x) * alpha
+        y = self.prev_rect.y + (self.rect.y - self.prev_rect.y) * alpha
+        return pygame.Rect(int(round(x)), int(round(y)), self.rect.width, self.rect.height)
+
     def move(self, dt, keys, restr):
         if self.timer > 0.0:
             self.timer -= dt
@@ -197,120 +268,463 @@ class Player(Object):
     def start_timer(self):
         self.timer = self.timer_max
 
-    def interact(self, game, objects, objects2, objects3):
-        if self.timer <= 0.0:
-            for obj in objects:
-                if self.rect.colliderect(obj.rect) and (game.world == obj.view[0] and game.loc == obj.view[1]):
-                    self.start_timer()
-                    # PICKUP
-                    if obj.type == 'pickup' or obj.type == 'use':
-                        if obj.can_use(self, objects, objects2, objects3): # pickup the object
-                            self.check_swaps(obj, game)
-                            if obj.type == 'pickup':
-                                game.sound_pickup.play()
-                                new_item = pygame.image.load(os.path.join('assets', obj.name+'_inv'+'.png'))
-                                self.inventory[obj.name] = {'image': new_item, 'uses': obj.uses}
-                            else:
-                                game.sound_toggle.play()
-                            if self.rect.y < 200:
-                                game.message(self.rect.x, self.rect.y + self.height/2, obj.message)
-                            else:
-                                game.message(self.rect.x, self.rect.y - self.height/2, obj.message)
-                            objects.remove(obj)
-                        else:
-                            game.sound_etoggle.play()
-                            if self.rect.y < 200:
-                                game.message(self.rect.x, self.rect.y + self.height/2, obj.error)
-                            else:
-                                game.message(self.rect.x, self.rect.y - self.height/2, obj.error)
-                    # TOGGLE
-                    elif obj.type == 'toggle':
-                        if obj.can_use(self, objects, objects2, objects3):
-                            game.sound_toggle.play()
-                            self.check_swaps(obj, game)
-                            if obj.anim == 'idle':
-                                obj.set_anim('on')
-                                game.message(self.rect.x, self.rect.y - self.height, obj.response)
-                            else:
-                                obj.set_anim('idle')
-                                game.message(self.rect.x, self.rect.y - self.height, obj.message)
-                        else:
-                            if obj.breaks and obj.anim == 'on':
-                                game.sound_toggle.play()
-                                game.message(self.rect.x, self.rect.y - self.height, obj.response)
-                            else:
-                                game.sound_etoggle.play()
-                                game.message(self.rect.x, self.rect.y - self.height, obj.error)
-                    # NPC
-                    elif obj.type == 'npc':
-                        if obj.can_use(self, objects, objects2, objects3):
-                            game.sound_enpc.play()
-                            self.check_swaps(obj, game)
-                            if self.rect.centery < 300:
-                                game.message(self.rect.x, self.rect.centery + self.rect.height*.5, obj.message)
-                            else:
-                                game.message(self.rect.x, self.rect.centery - self.rect.height - 40, obj.message)
-                        else:
-                            game.sound_npc.play()
-                            if self.rect.centery < 300:
-                                game.message(self.rect.x, self.rect.centery + self.rect.height, obj.error)
-                            else:
-                                game.message(self.rect.x, self.rect.centery - self.rect.height - 40, obj.error)
-                    # DOOR
-                    elif obj.type == 'door':
-                        if obj.can_use(self, objects, objects2, objects3):
-                            game.sound_door.play()
-                            self.check_swaps(obj, game)
-                            game.message(self.rect.x, self.rect.y - self.height/2, obj.response)
-                            game.world, game.loc = obj.to
-
-                            self.rect.centerx = 400
-                            self.rect.bottom = 490
-                            break
-                        else:
-                            game.message(self.rect.x, self.rect.y - self.height/2, obj.error)
-
+    # one swap per object, level.validate reports more
     def add_swap(self, f, t, at):
-        if not self.swaps.has_key(at):
-            self.swaps[at] = {'from':f, 'to':t}
-        else:
-            self.swaps[at].append({'from':f, 'to':t})
+        self.swaps[at] = {'from':f, 'to':t}
 
     def check_swaps(self, obj, game):
-        if self.swaps.has_key(obj.name):
+        if obj.name in self.swaps:
             for item in self.swaps[obj.name]['from']:
-                if not self.inventory.has_key(item):
+                if item not in self.inventory:
                     return
             for item in self.swaps[obj.name]['from']:
                 self.use_item(item, game)
             for item in self.swaps[obj.name]['to'][0]:
-                newitem = pygame.image.load(os.path.join('assets', item + '_inv.png'))
+                newitem = assets.load(item + '_inv.png')
                 self.inventory[item] = {'image': newitem, 'uses': self.swaps[obj.name]['to'][1]}
                 game.message(self.rect.x, self.rect.y - self.height/2, "sweet/"+item)
 
 
-    def draw_inv(self, display):
+    # (name, image, rect) for each inventory slot
+    def inv_items(self):
+        items = []
         slot = 0
         w = 50
         for item in self.inventory:
-            h = self.inventory[item]['image'].get_height()
-            display.blit(self.inventory[item]['image'], (w*slot+10, 0, w, h))
+            image = self.inventory[item]['image']
+            items.append((item, image, pygame.Rect(w*slot+10, 0, image.get_width(), image.get_height())))
             slot += 1
+        return items
 
     def use_item(self, name, game):
         self.inventory[name]['uses'] -= 1
         if self.inventory[name]['uses'] <= 0:
             item = self.inventory.pop(name)
 
+# what using each type of object does, see Interactions
+def use_pickup(game, player, obj):
+    if obj.can_use(player, game.objects): # pickup the object
+        player.check_swaps(obj, game)
+        if obj.type == 'pickup':
+            game.audio.play('pickup')
+            new_item = assets.load(obj.name+'_inv'+'.png')
+            player.inventory[obj.name] = {'image': new_item, 'uses': obj.uses}
+        else:
+            game.audio.play('toggle')
+        if player.rect.y < 200:
+            game.message(player.rect.x, player.rect.y + player.height/2, obj.message)
+        else:
+            game.message(player.rect.x, player.rect.y - player.height/2, obj.message)
+        game.objects.remove(obj)
+    else:
+        game.audio.play('e_toggle')
+        if player.rect.y < 200:
+            game.message(player.rect.x, player.rect.y + player.height/2, obj.error)
+        else:
+            game.message(player.rect.x, player.rect.y - player.height/2, obj.error)
+
+def use_toggle(game, player, obj):
+    if obj.can_use(player, game.objects):
+        game.audio.play('toggle')
+        player.check_swaps(obj, game)
+        if obj.anim == 'idle':
+            obj.set_anim('on')
+            game.message(player.rect.x, player.rect.y - player.height, obj.response)
+        else:
+            obj.set_anim('idle')
+            game.message(player.rect.x, player.rect.y - player.height, obj.message)
+    else:
+        if obj.breaks and obj.anim == 'on':
+            game.audio.play('toggle')
+            game.message(player.rect.x, player.rect.y - player.height, obj.response)
+        else:
+            game.audio.play('e_toggle')
+            game.message(player.rect.x, player.rect.y - player.height, obj.error)
+
+def use_npc(game, player, obj):
+    if obj.can_use(player, game.objects):
+        game.audio.play('npc')
+        player.check_swaps(obj, game)
+        if player.rect.centery < 300:
+            game.message(player.rect.x, player.rect.centery + player.rect.height*.5, obj.message)
+        else:
+            game.message(player.rect.x, player.rect.centery - player.rect.height - 40, obj.message)
+    else:
+        game.audio.play('e_npc')
+        if player.rect.centery < 300:
+            game.message(player.rect.x, player.rect.centery + player.rect.height, obj.error)
+        else:
+            game.message(player.rect.x, player.rect.centery - player.rect.height - 40, obj.error)
+
+def use_door(game, player, obj):
+    if obj.can_use(player, game.objects):
+        game.audio.play('door')
+        player.check_swaps(obj, game)
+        game.message(player.rect.x, player.rect.y - player.height/2, obj.response)
+        game.world, game.loc = obj.to
+
+        player.rect.centerx = 400
+        player.rect.bottom = 490
+    else:
+        game.message(player.rect.x, player.rect.y - player.height/2, obj.error)
+
+
+class Interactions:
+    # handles the interaction key. the objects on the shown view whose
+    # visible pixels touch the player's rect are looked up once and only
+    # the first of them is used:
+    # higher layers first, then by type in PRIORITY order, then the one
+    # added to the level first. what using an object does is up to the
+    # handler registered for its type
+    PRIORITY = ['pickup', 'use', 'toggle', 'npc', 'door']
+
+    def __init__(self):
+        self.handlers = {}
+        self.register('pickup', use_pickup)
+        self.register('use', use_pickup)
+        self.register('toggle', use_toggle)
+        self.register('npc', use_npc)
+        self.register('door', use_door)
+
+    # handler(game, player, obj) is called when an object of type typ is used
+    def register(self, typ, handler):
+        self.handlers[typ] = handler
+
+    def rank(self, objects, obj):
+        layer, seq = objects.keys[obj]
+        typ = self.PRIORITY.index(obj.type) if obj.type in self.PRIORITY else len(self.PRIORITY)
+        return (-layer, typ, seq)
+
+    # the objects the player could use right now, most important first
+    def candidates(self, game, player):
+        objects = game.objects
+        found = [obj for obj in objects.colliding(player.rect, game.world, game.loc, mask=pygame.mask.Mask(player.rect.size, True))
+                 if obj.type in self.handlers]
+        found.sort(key=lambda obj: self.rank(objects, obj))
+        return found
+
+    # uses the most important object the player touches, returns it
+    def dispatch(self, game, player):
+        if player.timer > 0.0:
+            return None
+        found = self.candidates(game, player)
+        if not found:
+            return None
+        obj = found[0]
+        player.start_timer()
+        self.handlers[obj.type](game, player, obj)
+        return obj
+
+
+class ObjectIndex:
+    # objects are bucketed by the view they live on, and each view keeps a
+    # uniform grid of cells so collision lookups only test nearby objects.
+    # objects with no view are visible everywhere and live under None.
+    # layer decides draw order (higher draws on top)
+    # a name table tracks every object ever added, whether it is still in
+    # the world and whether it is toggled on, so requirement checks are
+    # plain dictionary lookups
+    def __init__(self, cell_size=100):
+        self.cell_size = cell_size
+
+        self.table = {} # name -> [object, toggled on, still in world]
+        self.deps = {} # name -> names that have to be dealt with first
+
+        self.views = {} # view -> objects on that view, in draw order
+        self.grids = {} # view -> {(cx, cy): [objects]}
+        self.keys = {} # object -> (layer, insertion order)
+        self.gone = {} # removed object -> its key, so it can be put back
+        self.placed = {} # object -> (view, cells) it was indexed under
+        self.count = 0
+        self.changed = set() # names toggled, removed or put back, cleared by whoever reads it
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(sorted(self.keys, key=self.keys.get))
+
+    def __contains__(self, obj):
+        return obj in self.keys
+
+    def cells(self, rect):
+        s = self.cell_size
+        return [(cx, cy) for cx in range(rect.left // s, (rect.right - 1) // s + 1)
+                         for cy in range(rect.top // s, (rect.bottom - 1) // s + 1)]
+
+    def add(self, obj, layer=0):
+        if obj in self.keys:
+            return
+        self.keys[obj] = (layer, self.count)
+        self.count += 1
+        self.table[obj.name] = [obj, obj.anim != 'idle', True]
+        obj.index = self
+        self.place(obj)
+
+    def remove(self, obj):
+        if obj not in self.keys:
+            return
+        self.unplace(obj)
+        self.gone[obj] = self.keys.pop(obj)
+        self.table[obj.name][2] = False
+        self.changed.add(obj.name)
+        obj.index = None
+
+    # puts a removed object back where it was in the draw order
+    def restore(self, obj):
+        if obj not in self.gone:
+            return
+        self.keys[obj] = self.gone.pop(obj)
+        self.table[obj.name] = [obj, obj.anim != 'idle', True]
+        self.changed.add(obj.name)
+        obj.index = self
+        self.place(obj)
+
+    # called by the object when its animation changes
+    def set_on(self, obj):
+        self.table[obj.name][1] = obj.anim != 'idle'
+        self.changed.add(obj.name)
+
+    def lookup(self, name):
+        entry = self.table.get(name)
+        return entry and entry[0]
+
+    def present(self, name):
+        entry = self.table.get(name)
+        return bool(entry and entry[2])
+
+    def is_on(self, name):
+        entry = self.table.get(name)
+        return bool(entry and entry[1])
+
+    # item name -> name of the object that hands it out, either by being
+    # picked up or through one of the player's swaps
+    def providers(self, swaps):
+        providers = {}
+        for name in self.table:
+            if self.table[name][0].type == 'pickup':
+                providers[name] = name
+        for at in swaps:
+            for item in swaps[at]['to'][0]:
+                providers.setdefault(item, at)
+        return providers
+
+    # builds the dependency graph between objects from their reqs, unreqs,
+    # parents and the swaps that produce the items they need
+    def link(self, swaps):
+        providers = self.providers(swaps)
+        self.deps = {}
+        for name in self.table:
+            obj = self.table[name][0]
+            deps = set()
+            for req in obj.reqs:
+                if req in providers:
+                    deps.add(providers[req])
+            if name in swaps:
+                for item in swaps[name]['from']:
+                    if item in providers:
+                        deps.add(providers[item])
+            deps.update(obj.unreqs)
+            deps.update(obj.parents)
+            deps.discard(name)
+            self.deps[name] = deps
+        return self.deps
+
+    # returns a list of problems with the puzzle chain, empty if it is sound
+    def validate(self, swaps):
+        problems = []
+        providers = self.providers(swaps)
+        self.link(swaps)
+
+        for name in sorted(self.table):
+            obj = self.table[name][0]
+            for req in obj.reqs:
+                if req not in providers:
+                    problems.append("%s needs %s, which nothing provides" % (name, req))
+            for unreq in obj.unreqs:
+                if unreq not in self.table:
+                    problems.append("%s waits on %s, which is not in the world" % (name, unreq))
+            for parent in obj.parents:
+                if parent not in self.table:
+                    problems.append("%s has parent %s, which is not in the world" % (name, parent))
+                elif self.table[parent][0].type not in ('toggle', 'pickup', 'use'):
+                    # a parent is satisfied once it is on or gone
+                    problems.append("%s has parent %s, which can't be toggled or removed" % (name, parent))
+
+        # a cycle means none of the objects on it can ever be used. the walk
+        # keeps the names it is inside of on path, with what is left of each
+        # one's dependencies on stack
+        done = set()
+        for start in sorted(self.deps):
+            if start in done:
+                continue
+            path, at = [start], {start: 0}
+            stack = [iter(sorted(self.deps.get(start, ())))]
+            while stack:
+                dep = next(stack[-1], None)
+                if dep is None:
+                    name = path.pop()
+                    del at[name]
+                    done.add(name)
+                    stack.pop()
+                    continue
+                if dep in done:
+                    continue
+                if dep in at:
+                    problems.append("dependency cycle: " + " -> ".join(path[at[dep]:] + [dep]))
+                    continue
+                at[dep] = len(path)
+                path.append(dep)
+                stack.append(iter(sorted(self.deps.get(dep, ()))))
+
+        return problems
+
+    # called by the object when its position or view changes
+    def update(self, obj):
+        self.unplace(obj)
+        self.place(obj)
+
+    def place(self, obj):
+        view = obj.view
+        cells = self.cells(obj.rect)
+        objs = self.views.setdefault(view, [])
+        objs.append(obj)
+        objs.sort(key=self.keys.get)
+        grid = self.grids.setdefault(view, {})
+        for cell in cells:
+            grid.setdefault(cell, []).append(obj)
+        self.placed[obj] = (view, cells)
+
+    def unplace(self, obj):
+        view, cells = self.placed.pop(obj)
+        self.views[view].remove(obj)
+        grid = self.grids[view]
+        for cell in cells:
+            grid[cell].remove(obj)
+            if not grid[cell]:
+                del grid[cell]
+
+    # every object drawn on this view, bottom layer first
+    def in_view(self, world, loc):
+        objs = self.views.get((world, loc), [])
+        if self.views.get(None):
+            objs = sorted(objs + self.views[None], key=self.keys.get)
+        return objs
+
+    # objects on the view whose rect overlaps rect. with mask (the pixels
+    # of whatever rect is the bounds of) only objects whose visible pixels
+    # touch it count
+    def colliding(self, rect, world, loc, layer=None, mask=None):
+        found = []
+        seen = set()
+        for view in ((world, loc), None):
+            grid = self.grids.get(view)
+            if not grid:
+                continue
+            for cell in self.cells(rect):
+                for obj in grid.get(cell, ()):
+                    if obj in seen:
+                        continue
+                    seen.add(obj)
+                    if layer is not None and self.keys[obj][0] != layer:
+                        continue
+                    area = obj.rect
+                    if not rect.colliderect(area):
+                        continue
+                    if mask is not None and mask.overlap(obj.mask(), (area.x - rect.x, area.y - rect.y)) is None:
+                        continue
+                    found.append(obj)
+        found.sort(key=self.keys.get)
+        return found
+
+
 class Game:
-    def setup_images(self, world, num):
-        self.bg[world] = []
+    # logic size everything is laid out in
+    SIZE = (800, 600)
+
+    def __init__(self, level_path=os.path.join('levels', 'main.json'), dirty_rects=True, record=None, fps=60,
+                 profile=False, trace=None, headless=False, scale=1.0, scale_cache=None, memory_budget=None):
+        self.level_path = level_path
+        # the game is laid out at 800x600 logic pixels and drawn at scale
+        # times that on screen, None fits it to the display. logic
+        # coordinates are only mapped to the screen when drawing. scaled
+        # backgrounds are kept in scale_cache if set, see resources.scaled_file
+        self.scale = scale
+        self.scale_cache = scale_cache
+        # headless games never show a frame or play a sound, see server.py
+        self.headless = headless
+        # per-phase frame timings, F3 shows them on screen. trace is a file
+        # to save them to for chrome://tracing when the game quits
+        self.trace = trace
+        self.profiler = Profiler(profile, trace is not None)
+        # the simulation always steps at tick_rate with a fixed dt, while
+        # frames are drawn at up to fps (0 draws as fast as possible)
+        self.fps = fps
+        self.tick_rate = 60
+        self.dt = 1000.0 / self.tick_rate / 50.0
+        self.max_steps = 5 # steps to catch up on per frame before giving up
+        # only redraw changed parts of the screen instead of full frames
+        self.dirty_rects = dirty_rects
+        # file to write the played inputs to, see replay.py
+        self.record = record
+        self.recording = []
+        # what the interaction key does, per object type
+        self.interactions = Interactions()
+        # bytes held by surfaces, F4 shows them on screen. with a budget
+        # set, views the player leaves drop what they can to stay under it
+        self.memory = Memory(assets, store, memory_budget)
+
+    # backgrounds are only decoded once a view is shown or prefetched
+    def setup_images(self, world, num, files=None):
+        self.bg.add(world, num, files)
         self.restr.append({})
         for i in range(0, num):
-            newimage = pygame.image.load(os.path.join('assets', 'bg_'+str(world)+'_'+str(i)+'.png'))
-            self.bg[world].append(newimage)
             self.add_restr(world, i) # set no restrictions by default
 
+    # decodes the views the player can reach next on the loader thread,
+    # the neighbour the player is heading to first, then door targets.
+    # with a memory budget other views make room for them first, and only
+    # as many as fit under the budget are loaded. when drawing scaled, the
+    # sprites of this view and those are scaled there as well
+    def prefetch(self):
+        if self.headless:
+            return
+        num = len(self.bg[self.world])
+        here = (self.world, self.loc)
+        step = 1 if self.player.rect.centerx > self.width / 2 else -1
+        views = [(self.world, (self.loc + step) % num), (self.world, (self.loc - step) % num)]
+        for obj in self.objects.in_view(self.world, self.loc):
+            if obj.type == 'door':
+                views.append(tuple(obj.to))
+        if self.memory.budget is not None:
+            views = [view for i, view in enumerate(views) if view != here and view not in views[:i] and
+                     view not in self.bg.surfaces and view not in self.bg.pending]
+            background = self.bg[self.world][self.loc]
+            size = background.get_pitch() * background.get_height()
+            self.memory.enforce(self, views, size * len(views))
+            views = views[:max(0, self.memory.room(self) // size)]
+        sprites = None
+        if self.scaler:
+            sprites = dict((view, self.sprites(view)) for view in [here] + views)
+        self.bg.prefetch(views, sprites)
+
+    # every frame that can be drawn on a view, and the inventory icons of
+    # what its objects hand out
+    def sprites(self, view):
+        frames = []
+        items = []
+        for obj in self.objects.in_view(view[0], view[1]) + [self.player]:
+            for anim in obj.frames:
+                frames.extend(obj.frames[anim])
+            if obj.type == 'pickup':
+                items.append(obj.name)
+            if obj.name in self.player.swaps:
+                items.extend(self.player.swaps[obj.name]['to'][0])
+        for item in items:
+            if item + '_inv.png' in assets:
+                frames.append(assets.load(item + '_inv.png'))
+        return frames
+
     def add_restr(self, world, loc, left=0, right=0, top=0, bot=0):
         self.restr[world][loc] = {'left':left, 'right':self.width-right, 'top':top, 'bot':self.height-bot}
 
@@ -319,21 +733,107 @@ class Game:
         self.timer = 0.0
         msgs = msg.split('/')
         for i in range(0, len(msgs)):
-            text = self.font.render(msgs[i], 0, (50,50,50))
+            text = self.text.render(msgs[i], self.font_color)
             self.messages.append([text, (x, y+i*(self.font_size))])
 
+    # everything drawn over the background this frame, bottom first, as
+    # (key, surface, rect) for the renderer
+    def drawables(self, alpha=1.0):
+        items = []
+        for obj in self.objects.in_view(self.world, self.loc):
+            items.append((obj, obj.surface(), obj.rect))
+        items.append((self.player, self.player.surface(), self.player.lerp(alpha)))
+        for i in range(0, len(self.messages)):
+            text, pos = self.messages[i]
+            items.append((('message', i), text, text.get_rect(topleft=pos)))
+        for item, image, rect in self.player.inv_items():
+            items.append((('inv', item), image, rect))
+        if self.profiler.overlay:
+            lines = self.profiler.overlay_lines()
+            for i in range(0, len(lines)):
+                items.append((('profiler', i), lines[i], (10, self.height - (len(lines) - i) * 18)))
+        if self.memory.overlay:
+            lines = self.memory.overlay_lines(self)
+            for i in range(0, len(lines)):
+                items.append((('memory', i), lines[i], (self.width - lines[i].get_width() - 10, 100 + i * 18)))
+        return items
+
+    # bytes held by surfaces, see Memory.measure
+    def memory_usage(self):
+        return self.memory.measure(self)
+
+    # keeps surfaces under budget bytes from now on, None for no limit
+    def set_memory_budget(self, budget):
+        self.memory.budget = budget
+        self.memory.enforce(self)
+
     def message_timer(self, dt):
         if self.timer < self.timer_max:
             self.timer += dt
         else:
             self.messages = []
 
-    def main(self):
-        self.width, self.height = (800, 600)
-        self.screen = pygame.display.set_mode((self.width, self.height))
+    # the biggest scale the logic size fits the display at
+    @classmethod
+    def fit(cls):
+        info = pygame.display.Info()
+        if info.current_w <= 0 or info.current_h <= 0:
+            return 1.0
+        return min(float(info.current_w) / cls.SIZE[0], float(info.current_h) / cls.SIZE[1])
+
+    def setup(self):
+        # startup runs in stages, the start view is on screen after the
+        # first and the rest loads behind it. self.startup keeps how long
+        # each stage took and when the first frame and the game were ready
+        self.startup = {}
+        began = t = clock()
+        self.width, self.height = self.SIZE
+        if self.scale is None:
+            self.scale = self.fit()
+        self.scaler = Scaler(assets, self.scale) if self.scale != 1.0 else None
+        size = (self.width, self.height)
+        if self.scaler:
+            size = self.scaler.to_screen(self.width, self.height)
+        self.screen = pygame.display.set_mode(size)
+        self.renderer = DirtyRenderer(self.screen, self.dirty_rects, self.profiler, assets.opaque)
         pygame.display.set_caption('disconnected worlds')
-        clock = pygame.time.Clock()
-        fps = 60
+        self.rect = pygame.Rect(0,0,self.width,self.height)
+
+        # the start view's background decodes on the loader threads while
+        # the level is read and the mixer starts
+        data = level.load(self.level_path)
+        # what build.py made ahead of time, if it ran
+        self.built = build.read_manifest()
+        self.load_views(data)
+        if not self.headless:
+            self.bg.prefetch([(self.world, self.loc)])
+
+        # the mixer starts on its own thread, sounds before it's up are skipped
+        self.audio = Audio('misc')
+        self.audio.add('door', 'door.wav', priority=3)
+        self.audio.add('pickup', 'pickup.wav', priority=2)
+        self.audio.add('toggle', 'toggle.wav', priority=2)
+        self.audio.add('npc', 'npc.wav', priority=1)
+        self.audio.add('e_toggle', 'e_toggle.wav', interval=200)
+        self.audio.add('e_npc', 'e_npc.wav', volume=0.8, interval=200)
+        if not self.headless:
+            self.audio.start()
+        t = self.startup_stage('display', t)
+
+        if not self.headless:
+            self.screen.blit(self.bg[self.world][self.loc], self.rect)
+            pygame.display.flip()
+            pygame.event.pump()
+        t = self.startup_stage('first_frame', t)
+        self.startup['to_first_frame'] = t - began
+
+        # pack every sprite the level uses into a few atlas pages, unless
+        # build.py did already
+        names = level.images(data)
+        assets.use_atlas(build.atlas(self.built, names) or Atlas.cached('assets', names))
+        # inventory icons are needed mid-game, load them before it starts
+        assets.preload('*_inv.png')
+        t = self.startup_stage('images', t)
 
         # setup font and messages
         self.messages = []
@@ -341,321 +841,276 @@ class Game:
         self.timer = self.timer_max
         self.font_size = 32
         self.font = pygame.font.Font(os.path.join('misc', 'Before the sun rises.otf'), self.font_size)
+        self.font_color = (50,50,50)
+        self.text = TextCache(self.font, self.font_size)
         self.font_width_max = self.width * 0.3
-
-        pygame.mixer.init()
-        pygame.mixer.music.load(os.path.join('misc', 'above.ogg'))
-        pygame.mixer.music.play(-1)
-        self.sound_enpc = pygame.mixer.Sound(os.path.join('misc', 'npc.wav'))
-        self.sound_npc = pygame.mixer.Sound(os.path.join('misc', 'e_npc.wav'))
-        self.sound_npc.set_volume(0.8)
-        self.sound_pickup = pygame.mixer.Sound(os.path.join('misc', 'pickup.wav'))
-        self.sound_etoggle = pygame.mixer.Sound(os.path.join('misc', 'e_toggle.wav'))
-        self.sound_toggle = pygame.mixer.Sound(os.path.join('misc', 'toggle.wav'))
-        self.sound_door = pygame.mixer.Sound(os.path.join('misc', 'door.wav'))
-
-
-        self.player = Player('player', 'player.png', 128, 200)
-        self.player.set_pos(200, 300)
-        self.player.setup_frames('idle', 0, 3)
-        self.player.setup_frames('up', 1, 3)
-        self.player.setup_frames('right', 2, 3)
-        self.player.setup_frames('left', 3, 3)
-
-        self.p_bucket = Object('bucket', 'bucket.png', 97, 138)
-        self.p_bucket.set_pos(117, 392)
-        self.p_bucket.set_view(0, 0)
-        self.p_bucket.set_type('pickup')
-        self.p_bucket.set_messages(message="oh cool/a bucket")
-
-        self.d_arch = Object('arch', 'arch.png', 200, 252)
-        self.d_arch.set_pos(295, 115)
-        self.d_arch.set_view(0, 0)
-        self.d_arch.set_type('door', (1,0))
-
-        self.p_nail = Object('nail', 'nail.png', 50, 139)
-        self.p_nail.set_pos(584, 189)
-        self.p_nail.set_view(0, 0)
-        self.p_nail.set_type('pickup')
-        self.p_nail.set_messages(message='this is a rather/large nail')
-
-        self.d_archexit = Object('archexit', 'archexit.png', 269, 203)
-        self.d_archexit.set_pos(100, 398)
-        self.d_archexit.set_view(1, 0)
-        self.d_archexit.set_type('door', (0,0))
-
-        self.t_firebreather = Object('firebreather', 'firebreather.png', 359, 320)
-        self.t_firebreather.set_pos(441, 130)
-        self.t_firebreather.set_view(1, 0)
-        self.t_firebreather.set_type('toggle')
-        self.t_firebreather.add_req('match')
-        self.t_firebreather.set_messages(error='"fire fire fire?"', response='"thanks thanks thanks"')
-        self.t_firebreather.setup_frames('on', 1, 2)
-
-        self.n_cow = Object('cow', 'cow.png', 277, 244)
-        self.n_cow.set_pos(180, 60)
-        self.n_cow.set_view(0, 1)
-        self.n_cow.set_type('npc')
-        self.n_cow.set_messages(message='"moo"')
-
-        self.n_cowguy = Object('cowguy', 'cowguy.png', 166, 319)
-        self.n_cowguy.set_pos(510, 140)
-        self.n_cowguy.set_view(0 ,1)
-        self.n_cowguy.set_type('npc')
-        self.n_cowguy.add_req('milk')
-        self.n_cowguy.set_messages(error='"i have no/jars left"', message='"they say hot milk/will make anyone/fall asleep"')
-
-        self.p_coin = Object('coin', 'coin.png', 83, 52)
-        self.p_coin.set_pos(200, 500)
-        self.p_coin.set_view(0, 2)
-        self.p_coin.set_type('pickup')
-        self.p_coin.set_messages(message='i should return this...')
-
-        self.d_shopdoor = Object('shopdoor', 'shopdoor.png', 62, 121)
-        self.d_shopdoor.set_pos(100, 120)
-        self.d_shopdoor.set_view(0, 2)
-        self.d_shopdoor.set_type('door', (2, 0))
-
-        self.n_shopman = Object('shopman', 'shopman.png', 145, 202)
-        self.n_shopman.set_pos(120, 20)
-        self.n_shopman.set_view(2, 0)
-        self.n_shopman.set_type('npc')
-        self.n_shopman.set_messages(message='"hmph!"')
-
-        self.d_shopmat = Object('shopmat', 'mat.png', 209, 84)
-        self.d_shopmat.set_pos(250, 500)
-        self.d_shopmat.set_view(2, 0)
-        self.d_shopmat.set_type('door', (0, 2))
-
-        self.p_shoprope = Object('rope', 'shoprope.png', 120, 270)
-        self.p_shoprope.set_pos(650, 180)
-        self.p_shoprope.set_view(2, 0)
-        self.p_shoprope.set_type('pickup')
-        self.p_shoprope.set_messages(message="neato/some rope")
-
-        self.p_match = Object('match', 'match.png', 41, 103)
-        self.p_match.set_pos(530, 35)
-        self.p_match.set_view(2, 0)
-        self.p_match.set_type('pickup')
-        self.p_match.add_req('coin')
-        self.p_match.set_uses(100)
-        self.p_match.set_messages(message="i don't want/to set the world/on fire")
-
-        self.n_reader = Object('reader', 'reader.png', 50, 137)
-        self.n_reader.set_pos(300, 130)
-        self.n_reader.set_view(0, 3)
-        self.n_reader.set_type('npc')
-        self.n_reader.set_messages(message='"that guy is/a snob"', error='"woah/that hole/is scary"')
-
-        self.t_ropenail = Object('ropenail', 'ropenail.png', 84, 121)
-        self.t_ropenail.set_pos(640, 370)
-        self.t_ropenail.set_view(0, 3)
-        self.t_ropenail.set_type('toggle')
-        self.t_ropenail.add_req('nail')
-        self.t_ropenail.add_req('rope')
-        #self.t_ropenail.add_unreq('cardboard')
-        self.t_ropenail.setup_frames('on', 1, 2)
-        self.t_ropenail.set_messages(response="down i go/i do suppose", message="down i go/i do suppose", error="the ground here/looks soft")
-
-        self.t_hipster = Object('hipster', 'hipster.png', 323, 190)
-        self.t_hipster.set_pos(370, 350)
-        self.t_hipster.set_view(0, 3)
-        self.t_hipster.set_type('use')
-        self.t_hipster.add_req('hotmilk')
-        self.t_hipster.set_messages(error='"i cant/*yawn*/let you in/*yawn*"', message='"zzz..."')
-
-        #self.t_cardboard = Object('cardboard', 'cardboard.png', 375, 235)
-        #self.t_cardboard.set_pos(300, 250)
-        #self.t_cardboard.set_view(0, 3)
-        #self.t_cardboard.set_type('toggle')
-        #self.t_cardboard.add_req('match')
-        #self.t_cardboard.add_parent('hipster')
-        #self.t_cardboard.set_breaks()
-        #self.t_cardboard.set_messages(message="cardboard burns quickly")
-
-        self.d_hole = Object('hole', 'hole.png', 105, 48)
-        self.d_hole.set_pos(540, 450)
-        self.d_hole.set_view(0, 3)
-        self.d_hole.set_type('door', (3,0))
-        #self.d_hole.add_parent('cardboard')
-        self.d_hole.add_parent('ropenail')
-        self.d_hole.set_messages(error="it's a long/way down")
-
-        self.n_red = Object('red', 'red.png', 177, 207)
-        self.n_red.set_pos(500, 350)
-        self.n_red.set_view(3, 0)
-        self.n_red.set_type('npc')
-        self.n_red.add_parent('light')
-        self.n_red.set_messages(error='"hey! nice to/ meet you,/but please close/that damn hole"', message='"cardboard wants me/to thank you/for playing!"')
-
-        self.d_ldoor = Object('ldoor', 'ldoor.png', 108, 248)
-        self.d_ldoor.set_pos(150, 190)
-        self.d_ldoor.set_view(3, 0)
-        self.d_ldoor.set_type('door', (4,0))
-
-        self.t_light = Object('light', 'light.png', 137, 517)
-        self.t_light.set_pos(300, -30)
-        self.t_light.set_view(3, 0)
-        self.t_light.set_type('toggle')
-        self.t_light.add_req('fullballoon')
-        self.t_light.setup_frames('on', 1, 2)
-        self.t_light.set_messages(error="it seems i have/turned on the lights", message="wow/i have good aim")
-
-        self.n_record = Object('record', 'record.png', 171, 197)
-        self.n_record.set_pos(200, 200)
-        self.n_record.set_view(4, 0)
-        self.n_record.set_type('npc')
-        self.n_record.set_messages(message='i think i have/heard this song/before')
-
-        self.d_recordexit = Object('recordexit', 'mat.png', 209, 84)
-        self.d_recordexit.set_pos(250, 500)
-        self.d_recordexit.set_view(4, 0)
-        self.d_recordexit.set_type('door', (3, 0))
-
-        self.n_green = Object('green', 'green.png', 161, 319)
-        self.n_green.set_pos(400, 250)
-        self.n_green.set_view(4, 1)
-        self.n_green.set_type('npc')
-        self.n_green.add_req('balloon')
-        self.n_green.set_messages(error='it is just/sitting there/blowing air', message='"there you go friend"')
-
-        self.n_blue = Object('blue', 'blue.png', 137, 371)
-        self.n_blue.set_pos(175, 180)
-        self.n_blue.set_view(4, 2)
-        self.n_blue.set_type('npc')
-        self.n_blue.set_messages(error='"i love balloons!"', message='"nice balloon!"')
-        self.n_blue.add_req('balloon')
-
-        self.p_balloon = Object('balloon', 'balloon.png', 85, 48)
-        self.p_balloon.set_pos(500, 400)
-        self.p_balloon.set_view(4, 2)
-        self.p_balloon.set_type('pickup')
-        self.p_balloon.set_messages(message="i might be/able to use this/for something")
-
-
-
-        self.objects = pygame.sprite.Group()
-        self.objects2 = pygame.sprite.Group()
-        self.objects3 = pygame.sprite.Group()
-
-        # ADD OBJECTS TO THE OBJECT GROUP
-        # 0,0
-        self.objects.add(self.p_bucket)
-        self.objects.add(self.d_arch)
-        self.objects.add(self.p_nail)
-        # 1,0
-        self.objects.add(self.d_archexit)
-        self.objects.add(self.t_firebreather)
-        # 0,1
-        self.objects.add(self.n_cow)
-        self.objects.add(self.n_cowguy)
-        # 0,2
-        self.objects.add(self.p_coin)
-        self.objects.add(self.d_shopdoor)
-        # 2,0
-        self.objects.add(self.n_shopman)
-        self.objects.add(self.d_shopmat)
-        self.objects.add(self.p_shoprope)
-        self.objects.add(self.p_match)
-        # 0,3
-        self.objects.add(self.n_reader)
-        self.objects.add(self.d_hole)
-        self.objects3.add(self.t_hipster)
-        self.objects3.add(self.t_ropenail)
-        #self.objects2.add(self.t_cardboard)
-        # 3,0
-        self.objects.add(self.n_red)
-        self.objects.add(self.t_light)
-        self.objects.add(self.d_ldoor)
-        # 4,0
-        self.objects.add(self.n_record)
-        self.objects.add(self.d_recordexit)
-        # 4,1
-        self.objects.add(self.n_green)
-        # 4,2
-        self.objects.add(self.n_blue)
-        self.objects.add(self.p_balloon)
-
-
-        self.bg = {}
+        t = self.startup_stage('font', t)
+
+        self.load_level(data)
+        # the loader threads scale the sprites of views prefetched from now
+        # on, the first view's are needed before they could be done
+        if self.scaler:
+            self.scaler.warm(self.sprites((self.world, self.loc)))
+        t = self.startup_stage('level', t)
+        self.startup['to_ready'] = t - began
+
+    # times a stage of setup, also into the trace when profiling
+    def startup_stage(self, stage, start):
+        end = clock()
+        self.startup[stage] = end - start
+        if self.profiler.enabled:
+            self.profiler.record('startup_' + stage, start, end)
+        return end
+
+    # the state a game can be resumed from: view, player, inventory and
+    # which objects are toggled or gone. plain data, no surfaces
+    def snapshot(self):
+        anims = {}
+        removed = []
+        for name in sorted(self.objects.table):
+            obj, on, present = self.objects.table[name]
+            if obj.anim != 'idle':
+                anims[name] = obj.anim
+            if not present:
+                removed.append(name)
+        return {'level': self.level_path, 'view': [self.world, self.loc],
+                'player': [self.player.rect.x, self.player.rect.y, self.player.anim, self.player.timer],
+                'inventory': [[item, self.player.inventory[item]['uses']] for item in self.player.inventory],
+                'anims': anims, 'removed': removed}
+
+    # puts the game back into a snapshot's state, the level must be loaded
+    def restore(self, snap):
+        if snap['level'] != self.level_path:
+            raise ValueError('snapshot is of %s, not %s' % (snap['level'], self.level_path))
+        removed = set(snap['removed'])
+        for name in self.objects.table:
+            obj = self.objects.table[name][0]
+            if name in removed:
+                self.objects.remove(obj)
+            else:
+                self.objects.restore(obj)
+            obj.set_anim(snap['anims'].get(name, 'idle'))
+
+        self.player.inventory = {}
+        for item, uses in snap['inventory']:
+            self.player.inventory[item] = {'image': assets.load(item + '_inv.png'), 'uses': uses}
+        x, y, anim, timer = snap['player']
+        self.player.set_pos(x, y)
+        self.player.prev_rect = pygame.Rect(self.player.rect)
+        self.player.set_anim(anim)
+        self.player.timer = timer
+
+        self.world, self.loc = snap['view']
+        self.messages = []
+        self.renderer.invalidate()
+        self.prefetch()
+        self.audio.enter(self.world)
+
+    def save_snapshot(self, path):
+        f = open(path, 'w')
+        json.dump(self.snapshot(), f, separators=(',', ':'), sort_keys=True)
+        f.close()
+
+    def load_snapshot(self, path):
+        f = open(path)
+        snap = json.load(f)
+        f.close()
+        self.restore(snap)
+
+    # the views of a loaded level with their backgrounds and restrictions
+    def load_views(self, data):
+        if getattr(self, 'bg', None) is not None:
+            self.bg.stop()
+        self.bg = Backgrounds('assets', scale=self.scale, cache=self.scale_cache, scaler=self.scaler)
+        self.bg.built = build.backgrounds(self.built)
         self.restr = []
-        self.world = 0
-        self.loc = 3
-        self.setup_images(0, 4) # world 0, 4 imgages
-        self.setup_images(1, 1) # world 1, 1 image
-        self.setup_images(2, 1) # world 2, 1 image
-        self.setup_images(3, 1) # world 3, 1 image
-        self.setup_images(4, 3) # world 4, 3 image
-        self.rect = pygame.Rect(0,0,self.width,self.height)
-
+        for world in range(0, len(data['worlds'])):
+            self.setup_images(world, data['worlds'][world])
         # setup restrictions for each view&world
-        self.add_restr(0, 0, top=200, left=100)
-        self.add_restr(0, 1, top=200)
-        self.add_restr(0, 2, top=200)
-        self.add_restr(0, 3, top=200, right=100)
-        self.add_restr(1, 0, top=200)
-        self.add_restr(2, 0, top=200)
-        self.add_restr(3, 0, top=450, left=100, right=50, bot=100)
-        self.add_restr(4, 0, top=200, left=100)
-        self.add_restr(4, 1, top=420, bot=100)
-        self.add_restr(4, 2, top=200, right=100)
-
-        self.player.add_swap(['bucket'], [['milk'], 1], 'cow')
-        self.player.add_swap(['milk'], [['hotmilk'], 1], 'firebreather')
-        self.player.add_swap(['balloon'], [['fullballoon'], 1], 'green')
-
-        while 1:
-            dt = clock.tick(fps)
-            dt = dt / 50.0
+        for restr in data.get('restrictions', ()):
+            self.add_restr(restr['view'][0], restr['view'][1], left=restr.get('left', 0),
+                           right=restr.get('right', 0), top=restr.get('top', 0), bot=restr.get('bot', 0))
+        self.world, self.loc = data['start']
+
+    # builds the player, objects and swaps of a loaded level, its views
+    # must be loaded already
+    def load_level(self, data):
+        spec = data['player']
+        self.player = Player(spec['name'], spec['image'], spec['size'][0], spec['size'][1])
+        self.player.set_pos(*spec['pos'])
+        for anim, row, num in spec['frames']:
+            self.player.setup_frames(anim, row, num)
+
+        self.objects = ObjectIndex()
+        self.always = [] # objects animated even when their view isn't shown
+        for spec in data['objects']:
+            obj = Object(spec['name'], spec['image'], spec['size'][0], spec['size'][1])
+            obj.set_pos(*spec['pos'])
+            obj.set_view(*spec['view'])
+            obj.set_type(spec['type'], tuple(spec['to']) if 'to' in spec else None)
+            for anim, row, num in spec.get('frames', ()):
+                obj.setup_frames(anim, row, num)
+            for req in spec.get('reqs', ()):
+                obj.add_req(req)
+            for unreq in spec.get('unreqs', ()):
+                obj.add_unreq(unreq)
+            for parent in spec.get('parents', ()):
+                obj.add_parent(parent)
+            if 'uses' in spec:
+                obj.set_uses(spec['uses'])
+            if spec.get('breaks'):
+                obj.set_breaks()
+            obj.set_messages(spec.get('message'), spec.get('error'), spec.get('response'))
+            self.objects.add(obj, spec.get('layer', 0))
+            if spec.get('global'):
+                self.always.append(obj)
+
+        # music per world, a single track plays everywhere
+        music = data.get('music')
+        for world in range(0, len(data['worlds'])):
+            if isinstance(music, list):
+                self.audio.add_music(world, music[world])
+            elif music:
+                self.audio.add_music(world, music)
+        self.audio.enter(self.world)
+
+        for swap in data.get('swaps', ()):
+            self.player.add_swap(swap['from'], [swap['to'], swap.get('uses', 1)], swap['at'])
+        self.prefetch()
+
+        # render every message the level can show before it starts
+        messages = []
+        for obj in self.objects:
+            messages.extend([obj.message, obj.error, obj.response])
+        for swap in data.get('swaps', ()):
+            messages.extend(["sweet/"+item for item in swap['to']])
+        self.text.warm(messages, self.font_color)
+
+        # check the puzzle chain before the game starts
+        problems = self.objects.validate(self.player.swaps)
+        if problems:
+            raise ValueError('\n'.join(problems))
+
+    # advances the game by dt, returns False when the game should quit
+    def step(self, dt, keys, events):
+        profiler = self.profiler
+        view = (self.world, self.loc)
+        t = profiler.start()
+        self.player.prev_rect = pygame.Rect(self.player.rect)
+        self.player.move(dt, keys, self.restr[self.world][self.loc])
+        profiler.stop('move', t)
+
+        for event in events:
+            if event.type == pygame.QUIT:
+                return False
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                return False
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                profiler.toggle_overlay()
+                self.renderer.invalidate()
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                self.memory.toggle_overlay()
+                self.renderer.invalidate()
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_SPACE or event.key == pygame.K_RETURN:
+                    t = profiler.start()
+                    self.interactions.dispatch(self, self.player)
+                    profiler.stop('interact', t)
+#           if event.type == pygame.KEYUP:
+#                if event.key == pygame.K_LEFT or event.key == pygame.K_s\
+#                or event.key == pygame.K_RIGHT or event.key == pygame.K_f\
+#                or event.key == pygame.K_UP or event.key == pygame.K_d\
+#                or event.key == pygame.K_DOWN or event.key == pygame.K_e:
+#                    self.player.set_anim('idle')
+
+        t = profiler.start()
+        self.loc = (self.loc + self.player.change_view(self.width, self.bg[self.world])) % len(self.bg[self.world])
+        if (self.world, self.loc) != view:
+            # the player jumped to a new view, don't slide in from the old spot
+            self.player.prev_rect = pygame.Rect(self.player.rect)
+            self.prefetch()
+            self.audio.enter(self.world)
+        profiler.stop('change_view', t)
+
+        # animate objects on the current view, the player and objects that
+        # are always animated, all at once
+        t = profiler.start()
+        slots = [obj.slot for obj in self.objects.in_view(self.world, self.loc)]
+        slots.extend([obj.slot for obj in self.always if obj.view != (self.world, self.loc) and obj in self.objects])
+        slots.append(self.player.slot)
+        store.animate(slots, dt)
+        profiler.stop('animate', t)
+        t = profiler.start()
+        self.message_timer(dt)
+        profiler.stop('messages', t)
+        self.memory.check(self)
+        return True
 
-            keys = pygame.key.get_pressed()
+    # alpha is how far the frame is between the last step and the next one
+    def draw(self, alpha=1.0):
+        # draw world, objects, player, messages and inventory
+        t = self.profiler.start()
+        background = self.bg[self.world][self.loc]
+        self.profiler.stop('bg_fetch', t)
+        t = self.profiler.start()
+        items = self.drawables(alpha)
+        if self.scaler:
+            scaler = self.scaler
+            items = [(key, scaler.get(surface), scaler.to_screen(rect[0], rect[1])) for key, surface, rect in items]
+        self.profiler.stop('drawables', t)
+        self.renderer.draw(background, items)
+        self.memory.check(self)
 
-            self.player.move(dt, keys, self.restr[self.world][self.loc])
+    def main(self):
+        self.setup()
+        clock = pygame.time.Clock()
+        accumulator = 0.0
+        events = []
+        running = True
 
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    return
-                if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-                    return
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_SPACE or event.key == pygame.K_RETURN:
-                        self.player.interact(self, self.objects3, self.objects, self.objects2)
-                        self.player.interact(self, self.objects2, self.objects, self.objects3)
-                        self.player.interact(self, self.objects, self.objects2, self.objects3)
-#               if event.type == pygame.KEYUP:
-#                    if event.key == pygame.K_LEFT or event.key == pygame.K_s\
-#                    or event.key == pygame.K_RIGHT or event.key == pygame.K_f\
-#                    or event.key == pygame.K_UP or event.key == pygame.K_d\
-#                    or event.key == pygame.K_DOWN or event.key == pygame.K_e:
-#                        self.player.set_anim('idle')
-
-            self.loc = (self.loc + self.player.change_view(self.width, self.bg[self.world])) % len(self.bg[self.world])
-
-            # draw world
-            self.screen.blit(self.bg[self.world][self.loc], self.rect)
-            # draw objects
-            for obj in self.objects:
-                obj.animate(dt)
-                obj.draw(self.screen, self.world, self.loc)
-            for obj in self.objects2:
-                obj.animate(dt)
-                obj.draw(self.screen, self.world, self.loc)
-            for obj in self.objects3:
-                obj.animate(dt)
-                obj.draw(self.screen, self.world, self.loc)
-            # draw player
-            self.player.animate(dt)
-            self.player.draw(self.screen, self.world, self.loc)
-            # draw messages
-            self.message_timer(dt)
-            for msg in self.messages:
-                self.screen.blit(msg[0], msg[1])
-            # draw inventory
-            self.player.draw_inv(self.screen)
-            # update screen
-            pygame.display.flip()
+        while running:
+            dt = clock.tick(self.fps)
+            dt = dt / 50.0
+            accumulator = min(accumulator + dt, self.dt * self.max_steps)
+
+            t = self.profiler.start()
+            keys = pygame.key.get_pressed()
+            events.extend(pygame.event.get())
+            self.profiler.stop('input', t)
+
+            # run as many fixed steps as the time since the last frame
+            # covers, events go to the first of them
+            while running and accumulator >= self.dt:
+                if self.record:
+                    self.recording.append(replay.record(self.dt, keys, events))
+                running = self.step(self.dt, keys, events)
+                events = []
+                accumulator -= self.dt
+
+            if running:
+                self.draw(accumulator / self.dt)
+                t = self.profiler.start()
+                self.audio.update()
+                self.profiler.stop('audio', t)
+
+        if self.record:
+            replay.save(self.record, self.recording)
+        if self.trace:
+            self.profiler.save_trace(self.trace)
+        self.close()
+
+    # ends the threads the game started
+    def close(self):
+        self.bg.stop()
 
 
 if __name__=='__main__':
-    pygame.init()
-    Game().main()
+    # the mixer is started by Audio off the main thread, the rest of
+    # pygame isn't used
+    pygame.display.init()
+    pygame.font.init()
+    # python main.py [scale], 'fit' fills the display
+    scale = 1.0
+    if len(sys.argv) > 1:
+        scale = None if sys.argv[1] == 'fit' else float(sys.argv[1])
+    Game(scale=scale).main()
@@ -0,0 +1,142 @@
+import pygame
+
+# pixel bytes of a surface. subsurfaces share their parent's pixels, so
+# callers count the parent (surface.get_abs_parent()) once instead
+def size(surface):
+    return surface.get_pitch() * surface.get_height()
+
+class Memory:
+    # accounts for the bytes the game's surfaces hold, per category and per
+    # world, and keeps them under budget bytes (None for no budget) by
+    # dropping what the current view doesn't show: other views'
+    # backgrounds first, then scaled copies, then lines of text. the game
+    # calls check after every step and frame, which enforces the budget
+    # when any of those caches added something since, and prefetches only
+    # as many backgrounds as fit (see room). sprites live on atlas pages
+    # shared by every world and are only counted.
+    # every surface is counted once, under the first category that holds it
+    CATEGORIES = ['screen', 'backgrounds', 'atlas', 'sprites', 'icons', 'cached', 'scaled', 'text', 'masks', 'overlay']
+
+    def __init__(self, assets, store, budget=None):
+        self.assets = assets
+        self.store = store
+        self.budget = budget
+        self.drops = 0
+        self.dropped = 0 # bytes
+        self.added = None # the caches' added counts when last enforced
+
+        self.overlay = False # draw the overlay on screen
+        self.font = None
+        self.lines = []
+        self.frames = 0
+
+    def measure(self, game):
+        categories = dict((name, 0) for name in self.CATEGORIES)
+        worlds = {} # world -> bytes only its views use, None for the rest
+        seen = set()
+
+        def count(category, surface, world=None):
+            root = surface.get_abs_parent()
+            if id(root) in seen:
+                return
+            seen.add(id(root))
+            categories[category] += size(root)
+            worlds[world] = worlds.get(world, 0) + size(root)
+
+        if pygame.display.get_surface() is not None:
+            count('screen', pygame.display.get_surface())
+        for view, entry in list(game.bg.surfaces.items()):
+            count('backgrounds', entry[0], view[0])
+        assets = self.assets
+        if assets.atlas:
+            for page in assets.atlas.pages:
+                count('atlas', page)
+        for obj in [game.player] + list(game.objects):
+            world = obj.view[0] if obj.view else None
+            for anim in obj.frames:
+                for frame in obj.frames[anim]:
+                    count('sprites', frame, world)
+        for name in list(assets.surfaces):
+            count('icons' if name.endswith('_inv.png') else 'cached', assets.surfaces[name])
+        if game.scaler:
+            for surface in game.scaler.copies():
+                count('scaled', surface)
+        for surface in list(game.text.lines.values()) + [text for text, pos in game.messages]:
+            count('text', surface)
+        for mask in list(assets.masks.values()) + list(assets.unions.values()):
+            w, h = mask.get_size()
+            categories['masks'] += (w + 7) // 8 * h
+            worlds[None] = worlds.get(None, 0) + (w + 7) // 8 * h
+        for line in game.profiler.lines + self.lines:
+            count('overlay', line)
+
+        shared = worlds.pop(None, 0)
+        return {'total': sum(categories.values()), 'budget': self.budget, 'categories': categories,
+                'worlds': worlds, 'shared': shared, 'objects': self.store.bytes(), 'drops': self.drops, 'dropped': self.dropped}
+
+    # enforces the budget if the caches it drops from grew since last time
+    def check(self, game):
+        if self.budget is not None and self.counts(game) != self.added:
+            self.enforce(game)
+
+    def counts(self, game):
+        return (game.bg.added, game.text.added, game.scaler.added if game.scaler else 0)
+
+    # bytes that can still be loaded without going over budget, None for no budget
+    def room(self, game):
+        if self.budget is None:
+            return None
+        return self.budget - self.measure(game)['total']
+
+    # drops what isn't shown (nor in the views of keep) until the game is
+    # reserve bytes under budget, returns the bytes freed
+    def enforce(self, game, keep=(), reserve=0):
+        if self.budget is None:
+            return 0
+        self.added = self.counts(game)
+        over = self.measure(game)['total'] + reserve - self.budget
+        if over <= 0:
+            return 0
+        views = set([(game.world, game.loc)]) | set(keep)
+        shown = set(surface for key, surface, rect in game.drawables())
+        caches = [(game.bg, views), (game.text, shown)]
+        if game.scaler:
+            caches.insert(1, (game.scaler, shown))
+        freed = 0
+        for cache, keep in caches:
+            while freed < over:
+                n = cache.drop(keep)
+                if not n:
+                    break
+                freed += n
+                self.drops += 1
+        self.dropped += freed
+        return freed
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+
+    # text surfaces for the overlay, measured again every 30 frames
+    def overlay_lines(self, game):
+        self.frames += 1
+        if self.frames % 30 != 1 and self.lines:
+            return self.lines
+        if self.font is None:
+            self.font = pygame.font.Font(None, 20)
+        report = self.measure(game)
+        rows = [('total', report['total'])]
+        if self.budget is not None:
+            rows.append(('budget', self.budget))
+        rows.extend((name, report['categories'][name]) for name in self.CATEGORIES if report['categories'][name])
+        rows.extend(('world %d' % world, report['worlds'][world]) for world in sorted(report['worlds']))
+        rows.append(('shared', report['shared']))
+        self.lines = [self.row(name, '%.2f MB' % (n / 1048576.0)) for name, n in rows]
+        return self.lines
+
+    def row(self, name, value, width=200):
+        line = pygame.Surface((width, 18))
+        line.fill((20, 20, 20))
+        line.blit(self.font.render(name, 1, (240, 240, 240), (20, 20, 20)), (4, 2))
+        text = self.font.render(value, 1, (240, 240, 240), (20, 20, 20))
+        line.blit(text, (width - 4 - text.get_width(), 2))
+        return line
@@ -0,0 +1,108 @@
+import time
+import json
+from collections import deque
+
+import pygame
+
+# the most precise clock there is
+clock = getattr(time, 'perf_counter', time.time)
+
+class Profiler:
+    # times the phases of each frame. the last window samples of every phase
+    # are kept for percentiles, and with trace set every sample is also
+    # kept (up to limit) to be saved as a chrome://tracing json file.
+    # when disabled start/stop cost next to nothing
+    def __init__(self, enabled=False, trace=False, window=300, limit=1000000):
+        self.enabled = enabled or trace
+        self.tracing = trace
+        self.window = window
+        self.limit = limit
+
+        self.samples = {} # phase -> recent durations in seconds
+        self.order = [] # phases in the order they were first seen
+        self.events = [] # (phase, start, end) for the trace
+        self.epoch = clock()
+
+        self.overlay = False # draw the overlay on screen
+        self.font = None
+        self.lines = []
+        self.frames = 0
+
+    def start(self):
+        if not self.enabled:
+            return 0.0
+        return clock()
+
+    def stop(self, phase, start):
+        if not self.enabled:
+            return
+        end = clock()
+        self.record(phase, start, end)
+
+    # a phase made up of several pieces timed separately
+    def add(self, phase, seconds):
+        if not self.enabled:
+            return
+        end = clock()
+        self.record(phase, end - seconds, end)
+
+    def record(self, phase, start, end):
+        samples = self.samples.get(phase)
+        if samples is None:
+            samples = self.samples[phase] = deque(maxlen=self.window)
+            self.order.append(phase)
+        samples.append(end - start)
+        if self.tracing and len(self.events) < self.limit:
+            self.events.append((phase, start, end))
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        if self.overlay:
+            self.enabled = True
+
+    def percentiles(self, phase, ps=(0.5, 0.95, 0.99)):
+        samples = sorted(self.samples.get(phase, ()))
+        if not samples:
+            return [0.0 for p in ps]
+        return [samples[min(len(samples) - 1, int(p * len(samples)))] for p in ps]
+
+    def summary(self):
+        out = {}
+        for phase in self.order:
+            p50, p95, p99 = self.percentiles(phase)
+            out[phase] = {'n': len(self.samples[phase]), 'p50': p50, 'p95': p95, 'p99': p99}
+        return out
+
+    # text surfaces for the overlay, rebuilt every 30 frames so the
+    # overlay itself stays cheap
+    def overlay_lines(self):
+        self.frames += 1
+        if self.frames % 30 != 1 and self.lines:
+            return self.lines
+        if self.font is None:
+            self.font = pygame.font.Font(None, 20)
+        rows = [['ms', 'p50', 'p95', 'p99']]
+        for phase in self.order:
+            rows.append([phase] + ['%.3f' % (p * 1000) for p in self.percentiles(phase)])
+        self.lines = [self.row(row) for row in rows]
+        return self.lines
+
+    # one line of the overlay, the numbers right aligned in their columns
+    def row(self, cells, widths=(100, 60, 60, 60)):
+        line = pygame.Surface((sum(widths) + 8, 18))
+        line.fill((20, 20, 20))
+        x = 4
+        for i in range(0, len(cells)):
+            text = self.font.render(cells[i], 1, (240, 240, 240), (20, 20, 20))
+            line.blit(text, (x if i == 0 else x + widths[i] - text.get_width(), 2))
+            x += widths[i]
+        return line
+
+    def save_trace(self, path):
+        events = []
+        for phase, start, end in self.events:
+            events.append({'name': phase, 'ph': 'X', 'pid': 1, 'tid': 1,
+                           'ts': (start - self.epoch) * 1e6, 'dur': (end - start) * 1e6})
+        f = open(path, 'w')
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        f.close()
@@ -0,0 +1,119 @@
+import pygame
+
+from profiler import Profiler
+
+class DirtyRenderer:
+    # draws a list of (key, surface, rect) items over a background.
+    # with dirty rects on, only the areas of items that appeared, moved,
+    # changed frame or went away since the last frame are redrawn and
+    # pushed to the display; otherwise every frame is drawn and flipped.
+    # items off the screen, or inside an item drawn later that opaque says
+    # has no see-through pixels, are never drawn
+    def __init__(self, screen, dirty_rects=True, profiler=None, opaque=None):
+        self.screen = screen
+        self.dirty_rects = dirty_rects
+        self.profiler = profiler or Profiler()
+        self.opaque = opaque
+        self.rect = screen.get_rect()
+
+        self.offscreen = 0
+        self.occluded = 0
+
+        self.background = None
+        self.last = {} # key -> (surface, rect) drawn last frame
+        self.full = True
+
+    # forces the next frame to be drawn completely
+    def invalidate(self):
+        self.full = True
+
+    def draw(self, background, items):
+        items = self.visible(items)
+        # the area a blit actually covers is the surface size at rect's corner
+        current = {}
+        for key, surface, rect in items:
+            current[key] = (surface, pygame.Rect(rect[0], rect[1], surface.get_width(), surface.get_height()))
+
+        profiler = self.profiler
+        if not self.dirty_rects or self.full or background is not self.background:
+            t = profiler.start()
+            self.screen.blit(background, self.rect)
+            profiler.stop('background', t)
+            t = profiler.start()
+            for key, surface, rect in items:
+                self.screen.blit(surface, rect)
+            profiler.stop('sprites', t)
+            t = profiler.start()
+            pygame.display.flip()
+            profiler.stop('flip', t)
+            self.full = False
+        else:
+            dirty = self.merge(self.changed(current))
+            background_time, sprites_time = 0.0, 0.0
+            for area in dirty:
+                t = profiler.start()
+                self.screen.set_clip(area)
+                self.screen.blit(background, area, area)
+                t2 = profiler.start()
+                for key, surface, rect in items:
+                    if area.colliderect(current[key][1]):
+                        self.screen.blit(surface, rect)
+                background_time += t2 - t
+                sprites_time += profiler.start() - t2
+            self.screen.set_clip(None)
+            profiler.add('background', background_time)
+            profiler.add('sprites', sprites_time)
+            t = profiler.start()
+            if dirty:
+                pygame.display.update(dirty)
+            profiler.stop('flip', t)
+
+        self.background = background
+        self.last = current
+
+    # the items that would show, in the same order
+    def visible(self, items):
+        shown = []
+        occluders = []
+        for item in reversed(items):
+            key, surface, rect = item
+            area = pygame.Rect(rect[0], rect[1], surface.get_width(), surface.get_height()).clip(self.rect)
+            if not area.width or not area.height:
+                self.offscreen += 1
+                continue
+            if [o for o in occluders if o.contains(area)]:
+                self.occluded += 1
+                continue
+            if self.opaque and self.opaque(surface):
+                occluders.append(area)
+            shown.append(item)
+        shown.reverse()
+        return shown
+
+    def stats(self):
+        return {'offscreen': self.offscreen, 'occluded': self.occluded}
+
+    # screen areas covered by items that differ from the last frame
+    def changed(self, current):
+        rects = []
+        for key in current:
+            if self.last.get(key) != current[key]:
+                rects.append(current[key][1])
+                if key in self.last:
+                    rects.append(self.last[key][1])
+        for key in self.last:
+            if key not in current:
+                rects.append(self.last[key][1])
+        return [r.clip(self.rect) for r in rects if r.colliderect(self.rect)]
+
+    # joins overlapping rects so no area is redrawn twice
+    def merge(self, rects):
+        merged = []
+        for rect in rects:
+            rect = pygame.Rect(rect)
+            i = rect.collidelist(merged)
+            while i != -1:
+                rect.union_ip(merged.pop(i))
+                i = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
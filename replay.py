@@ -0,0 +1,81 @@
+import json
+
+import pygame
+
+# input scripts and recorded play sessions share one format: a json list
+# of entries, each holding keys down for a number of ticks
+#   {"keys": ["right"], "ticks": 30}      hold right for 30 ticks
+#   {"press": ["space"]}                 press space for one tick
+#   {"dt": 0.34, "keys": ["up"]}         recorded frame time for the tick
+#   {"quit": true}                       close the game
+#   {"expect": {"world": 1, "loc": 0}}   checked by sim.py after the entry
+
+# keys the game reads while they are held, and keys it reacts to when pressed
+HELD = ['left', 'right', 'up', 'down', 's', 'f', 'e', 'd']
+PRESSED = ['space', 'return', 'escape', 'f3', 'f4']
+
+def keycode(name):
+    code = getattr(pygame, 'K_' + name, None)
+    if code is None:
+        code = getattr(pygame, 'K_' + name.upper())
+    return code
+
+class Keys:
+    # stands in for pygame.key.get_pressed()
+    def __init__(self, held=()):
+        self.held = set(keycode(name) for name in held)
+
+    def __getitem__(self, key):
+        return key in self.held
+
+# one entry for a frame played live
+def record(dt, keys, events):
+    entry = {'dt': dt}
+    held = [name for name in HELD if keys[keycode(name)]]
+    if held:
+        entry['keys'] = held
+    pressed = []
+    for event in events:
+        if event.type == pygame.QUIT:
+            entry['quit'] = True
+        if event.type == pygame.KEYDOWN and pygame.key.name(event.key) in PRESSED:
+            pressed.append(pygame.key.name(event.key))
+    if pressed:
+        entry['press'] = pressed
+    return entry
+
+# merges runs of identical entries into one with a tick count
+def compact(entries):
+    out = []
+    for entry in entries:
+        last = out and out[-1]
+        if last and 'press' not in entry and 'quit' not in entry and \
+           dict(last, ticks=1) == dict(entry, ticks=1):
+            last['ticks'] = last.get('ticks', 1) + entry.get('ticks', 1)
+        else:
+            out.append(dict(entry))
+    return out
+
+def save(path, entries):
+    f = open(path, 'w')
+    f.write('[\n' + ',\n'.join(json.dumps(e, sort_keys=True) for e in compact(entries)) + '\n]\n')
+    f.close()
+
+def load(path):
+    f = open(path)
+    script = json.load(f)
+    f.close()
+    return script
+
+# yields (dt, keys, events) for every tick of an entry, dt is None unless
+# the entry was recorded with one. presses only happen on the first tick
+def ticks(entry):
+    keys = Keys(entry.get('keys', ()))
+    events = []
+    for name in entry.get('press', ()):
+        events.append(pygame.event.Event(pygame.KEYDOWN, key=keycode(name)))
+    if entry.get('quit'):
+        events.append(pygame.event.Event(pygame.QUIT))
+    for i in range(0, entry.get('ticks', 1)):
+        yield entry.get('dt'), keys, events
+        events = []
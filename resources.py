@@ -0,0 +1,701 @@
+import os
+import glob
+import json
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import pygame
+
+# decodes image files on a pool of threads, returns name -> surface, None
+# for files that couldn't be read. pygame's image loader runs without the
+# interpreter lock, so the files really are decoded side by side
+def decode(path, names, workers=4):
+    names = list(names)
+    out = {}
+    work = queue.Queue()
+    for name in names:
+        work.put(name)
+
+    def run():
+        while True:
+            try:
+                name = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                out[name] = pygame.image.load(os.path.join(path, name))
+            except (pygame.error, IOError):
+                out[name] = None
+
+    threads = [threading.Thread(target=run) for i in range(0, min(workers, len(names)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return out
+
+# smoothscale only takes 24 and 32 bit surfaces
+def smooth(surface, size):
+    if surface.get_bitsize() < 24:
+        full = pygame.Surface(surface.get_size(), pygame.SRCALPHA, 32)
+        full.blit(surface, (0, 0))
+        surface = full
+    return pygame.transform.smoothscale(surface, size)
+
+# bump when scaled files are made differently
+SCALED_FORMAT = 1
+
+# surface, decoded from the image file path/name, smoothscaled by scale.
+# with cache set the result is kept there as png and read back instead of
+# scaling again, keyed by the file's stamp, the size of surface (which
+# the atlas may have trimmed) and the scale. reading a png back is only
+# faster than smoothscale where scaling is slow, so the cache is off
+# unless asked for
+def scaled_file(path, name, surface, scale, cache=None):
+    size = (int(round(surface.get_width() * scale)), int(round(surface.get_height() * scale)))
+    out = None
+    if cache:
+        try:
+            st = os.stat(os.path.join(path, name))
+            key = '%s %r %r %r %g %d' % (os.path.abspath(os.path.join(path, name)), st.st_mtime, st.st_size,
+                                          surface.get_size(), scale, SCALED_FORMAT)
+            out = os.path.join(cache, '%s.png' % hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+            scaled = pygame.image.load(out)
+            if scaled.get_size() == size:
+                return scaled
+        except (pygame.error, IOError, OSError):
+            pass
+    scaled = smooth(surface, size)
+    if out:
+        try:
+            if not os.path.isdir(cache):
+                os.makedirs(cache)
+            pygame.image.save(scaled, out + '.tmp.png')
+            os.rename(out + '.tmp.png', out)
+        except (pygame.error, IOError, OSError):
+            pass # the cache is only an optimization
+    return scaled
+
+class AssetCache:
+    # every image file is loaded once and kept in the display's pixel format.
+    # least recently used surfaces are dropped when the cache holds more
+    # than budget bytes, except pinned ones (inventory icons etc.)
+    def __init__(self, path='assets', budget=64*1024*1024):
+        self.path = path
+        self.budget = budget
+
+        self.surfaces = OrderedDict() # filename -> surface, oldest first
+        self.pinned = set()
+        self.bytes = 0
+
+        self.atlas = None # images packed into atlas pages come from there
+        self.tables = {} # (filename, width, height, row, num) -> frames
+        self.masks = weakref.WeakKeyDictionary() # surface -> its pygame.mask.Mask
+        self.opacity = weakref.WeakKeyDictionary() # surface -> whether it has no see-through pixels
+        self.unions = weakref.WeakKeyDictionary() # first frame of a frame list -> mask of all its frames
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, name):
+        return name in self.surfaces
+
+    # subsurfaces share their parent's pixels, which are counted there
+    def size(self, surface):
+        if surface.get_parent() is not None:
+            return 0
+        return surface.get_pitch() * surface.get_height()
+
+    # convert to the display format if there is a display to convert to
+    def convert(self, surface):
+        if pygame.display.get_surface() is None:
+            return surface
+        if surface.get_flags() & pygame.SRCALPHA:
+            return surface.convert_alpha()
+        return surface.convert()
+
+    def load(self, name, pin=False):
+        if name in self.surfaces:
+            self.hits += 1
+            surface = self.surfaces.pop(name)
+            self.surfaces[name] = surface
+        else:
+            self.misses += 1
+            if self.atlas and name in self.atlas:
+                surface = self.atlas.region(name)
+            else:
+                surface = self.convert(pygame.image.load(os.path.join(self.path, name)))
+            self.store(name, surface)
+        if pin:
+            self.pinned.add(name)
+        self.evict()
+        return surface
+
+    def store(self, name, surface):
+        self.surfaces[name] = surface
+        self.bytes += self.size(surface)
+
+    # the num frames of size width x height on the given row of a sheet.
+    # frame lists are shared by every object using the same sheet
+    def frames(self, name, width, height, row, num):
+        key = (name, width, height, row, num)
+        if key not in self.tables:
+            sheet = self.load(name)
+            self.tables[key] = []
+            for i in range(0, num):
+                # sheets trimmed by the atlas can end inside their last
+                # cells, what was cut off couldn't be seen anyway
+                cell = pygame.Rect(i*width, row*height, width, height).clip(sheet.get_rect())
+                if not cell.width or not cell.height:
+                    cell = pygame.Rect(0, 0, 0, 0)
+                frame = sheet.subsurface(cell)
+                self.tables[key].append(frame)
+        return self.tables[key]
+
+    # the opaque pixels of a surface, made the first time it is asked for
+    # and kept as long as the surface is
+    def mask(self, surface):
+        mask = self.masks.get(surface)
+        if mask is None:
+            mask = self.masks[surface] = pygame.mask.from_surface(surface)
+        return mask
+
+    # the pixels visible in any of a list of frames, so what touches an
+    # animated object doesn't depend on the frame it happens to show
+    def union_mask(self, frames):
+        mask = self.unions.get(frames[0])
+        if mask is None:
+            size = (max(f.get_width() for f in frames), max(f.get_height() for f in frames))
+            mask = pygame.mask.Mask(size)
+            for frame in frames:
+                mask.draw(self.mask(frame), (0, 0))
+            self.unions[frames[0]] = mask
+        return mask
+
+    # whether every pixel of a surface is opaque, so nothing under it shows.
+    # worked out once per surface, the renderer asks every frame
+    def opaque(self, surface):
+        opaque = self.opacity.get(surface)
+        if opaque is None:
+            if not surface.get_flags() & pygame.SRCALPHA and surface.get_colorkey() is None:
+                opaque = True
+            else:
+                opaque = self.mask(surface).count() == surface.get_width() * surface.get_height()
+            self.opacity[surface] = opaque
+        return opaque
+
+    # serves the atlas' images from now on instead of separate files
+    def use_atlas(self, atlas):
+        self.atlas = atlas
+        for name in list(self.surfaces):
+            if name in atlas:
+                self.bytes -= self.size(self.surfaces.pop(name))
+        for key in list(self.tables):
+            if key[0] in atlas:
+                del self.tables[key]
+        self.masks.clear()
+        self.opacity.clear()
+        self.unions.clear()
+
+    # load every file matching pattern and keep it around. files that
+    # aren't in the atlas are decoded on a pool of threads first
+    def preload(self, pattern, workers=4):
+        names = [os.path.basename(path) for path in sorted(glob.glob(os.path.join(self.path, pattern)))]
+        files = [name for name in names if name not in self.surfaces and not (self.atlas and name in self.atlas)]
+        decoded = decode(self.path, files, workers)
+        for name in files:
+            if decoded[name] is not None:
+                self.misses += 1
+                self.store(name, self.convert(decoded[name]))
+        for name in names:
+            self.load(name, pin=True)
+        return names
+
+    def evict(self):
+        for name in list(self.surfaces):
+            if self.bytes <= self.budget:
+                break
+            if name in self.pinned:
+                continue
+            self.bytes -= self.size(self.surfaces.pop(name))
+            self.evictions += 1
+
+    def clear(self):
+        self.surfaces.clear()
+        self.pinned.clear()
+        self.tables.clear()
+        self.masks.clear()
+        self.opacity.clear()
+        self.unions.clear()
+        self.atlas = None
+        self.bytes = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'surfaces': len(self.surfaces),
+                'bytes': self.bytes + (self.atlas.bytes() if self.atlas else 0)}
+
+
+class Scaler:
+    # screen sized copies of what the game draws at its logic size, for
+    # displays bigger or smaller than the 800x600 it is laid out in. every
+    # frame, icon or line of text is smoothscaled the first time it is drawn
+    # and the copy kept as long as the surface lives, so only what is shown
+    # gets scaled. the sprites of views being prefetched are scaled ahead of
+    # time on the loader threads, see warm. backgrounds are scaled by
+    # Backgrounds itself
+    def __init__(self, assets, scale):
+        self.assets = assets
+        self.scale = scale
+
+        self.surfaces = weakref.WeakKeyDictionary() # surface -> scaled copy
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.added = 0 # copies made, see Memory.check
+
+    def length(self, n):
+        return int(round(n * self.scale))
+
+    # logic coordinates to screen coordinates
+    def to_screen(self, x, y):
+        return (self.length(x), self.length(y))
+
+    def get(self, surface):
+        scaled = self.surfaces.get(surface)
+        if scaled is not None:
+            self.hits += 1
+            return scaled
+        self.misses += 1
+        return self.make(surface)
+
+    def make(self, surface):
+        scaled = smooth(surface, (self.length(surface.get_width()), self.length(surface.get_height())))
+        self.lock.acquire()
+        if surface not in self.surfaces:
+            self.surfaces[surface] = scaled
+            self.added += 1
+        scaled = self.surfaces[surface]
+        self.lock.release()
+        return scaled
+
+    # makes the copies of surfaces there are none of yet, called on the
+    # loader threads
+    def warm(self, surfaces):
+        for surface in surfaces:
+            if surface not in self.surfaces:
+                self.make(surface)
+
+    def copies(self):
+        self.lock.acquire()
+        try:
+            return list(self.surfaces.values())
+        finally:
+            self.lock.release()
+
+    # drops the copy of a surface that isn't in keep, returns the bytes it
+    # held, 0 when there is none
+    def drop(self, keep):
+        self.lock.acquire()
+        try:
+            for surface in list(self.surfaces.keys()):
+                if surface not in keep:
+                    scaled = self.surfaces.pop(surface)
+                    return scaled.get_pitch() * scaled.get_height()
+        finally:
+            self.lock.release()
+        return 0
+
+    def stats(self):
+        copies = self.copies()
+        return {'scale': self.scale, 'hits': self.hits, 'misses': self.misses, 'copies': len(copies),
+                'bytes': sum(s.get_pitch() * s.get_height() for s in copies)}
+
+
+class Atlas:
+    # packs many sprite sheets into a few large pages, so drawing touches
+    # fewer surfaces and startup opens a few pages instead of every file.
+    # sheets are placed on shelves, tallest first, with padding between them.
+    # pages end below their last shelf, and with trim on the see-through
+    # columns and rows along a sheet's right and bottom edges are left out:
+    # frames are cut from the top left, so nothing they show moves
+    FORMAT = 2
+
+    def __init__(self, size=2048, padding=1, trim=True):
+        self.size = size
+        self.padding = padding
+        self.trim = trim
+
+        self.pages = []
+        self.regions = {} # filename -> (page, x, y, width, height)
+
+    def __contains__(self, name):
+        return name in self.regions
+
+    def pack(self, sizes):
+        regions = {}
+        page, x, y, shelf = 0, 0, 0, 0
+        for name in sorted(sizes, key=lambda n: (-sizes[n][1], n)):
+            w, h = sizes[name]
+            if w > self.size or h > self.size:
+                continue # doesn't fit on a page, stays a separate file
+            if x + w > self.size:
+                x, y, shelf = 0, y + shelf, 0
+            if y + h > self.size:
+                page, x, y, shelf = page + 1, 0, 0, 0
+            regions[name] = (page, x, y, w, h)
+            x += w + self.padding
+            shelf = max(shelf, h + self.padding)
+        return regions
+
+    def build(self, path, names, workers=4):
+        images = decode(path, names, workers)
+        for name in names:
+            if images[name] is None:
+                raise pygame.error('cannot read %s' % os.path.join(path, name))
+        self.regions = self.pack(dict((name, self.extent(images[name])) for name in images))
+
+        heights = {}
+        for page, x, y, w, h in self.regions.values():
+            heights[page] = max(heights.get(page, 1), y + h)
+        self.pages = [pygame.Surface((self.size, heights[i]), pygame.SRCALPHA, 32) for i in range(0, len(heights))]
+        for name in self.regions:
+            page, x, y, w, h = self.regions[name]
+            # pages start out fully transparent, so max copies pixels exactly
+            self.pages[page].blit(images[name], (x, y), (0, 0, w, h), pygame.BLEND_RGBA_MAX)
+        self.convert()
+        return self
+
+    # the part of a sheet that goes on a page
+    def extent(self, image):
+        if not self.trim:
+            return image.get_size()
+        used = image.get_bounding_rect()
+        return (max(used.right, 1), max(used.bottom, 1))
+
+    def convert(self):
+        if pygame.display.get_surface() is not None:
+            self.pages = [page.convert_alpha() for page in self.pages]
+
+    def region(self, name):
+        page, x, y, w, h = self.regions[name]
+        return self.pages[page].subsurface(x, y, w, h)
+
+    def bytes(self):
+        return sum(page.get_pitch() * page.get_height() for page in self.pages)
+
+    # stamps of the source files, a cached atlas is only used if they match
+    @staticmethod
+    def stamps(path, names):
+        stamps = {}
+        for name in names:
+            st = os.stat(os.path.join(path, name))
+            stamps[name] = [st.st_mtime, st.st_size]
+        return stamps
+
+    def save(self, out, stamps):
+        if not os.path.isdir(out):
+            os.makedirs(out)
+        for i in range(0, len(self.pages)):
+            pygame.image.save(self.pages[i], os.path.join(out, 'page_%d.png' % i))
+        f = open(os.path.join(out, 'index.json'), 'w')
+        json.dump({'format': self.FORMAT, 'size': self.size, 'padding': self.padding, 'trim': self.trim,
+                   'stamps': stamps, 'regions': self.regions, 'pages': len(self.pages)}, f)
+        f.close()
+
+    def restore(self, out, stamps, workers=4):
+        try:
+            f = open(os.path.join(out, 'index.json'))
+            index = json.load(f)
+            f.close()
+        except (IOError, OSError, ValueError):
+            return False
+        if index.get('format') != self.FORMAT or index['size'] != self.size or \
+           index['padding'] != self.padding or index['trim'] != self.trim:
+            return False
+        # pages holding more files than asked for (see build.py) do as well
+        for name in stamps:
+            if index['stamps'].get(name) != stamps[name]:
+                return False
+        files = ['page_%d.png' % i for i in range(0, index['pages'])]
+        pages = decode(out, files, workers)
+        if None in pages.values():
+            return False
+        self.pages = [pages[name] for name in files]
+        self.regions = dict((name, tuple(r)) for name, r in index['regions'].items())
+        self.convert()
+        return True
+
+    # an atlas of the given files, read back from the cache directory when
+    # the files haven't changed since it was packed
+    @classmethod
+    def cached(cls, path, names, cache=os.path.join('.cache', 'atlas')):
+        names = sorted(set(names))
+        atlas = cls()
+        stamps = cls.stamps(path, names)
+        out = os.path.join(cache, hashlib.sha1('\n'.join(names).encode('utf-8')).hexdigest()[:16])
+        if atlas.restore(out, stamps):
+            return atlas
+        atlas.build(path, names)
+        try:
+            atlas.save(out, stamps)
+        except (IOError, OSError, pygame.error):
+            pass # the cache is only an optimization
+        return atlas
+
+
+class Backgrounds:
+    # backgrounds of every (world, loc) view, decoded the first time they
+    # are needed or ahead of time on up to workers loader threads when
+    # prefetched. at most capacity decoded backgrounds are kept, least
+    # recently used go first, except the view shown last and those of the
+    # latest prefetch. bg[world][loc] and len(bg[world]) work like nested
+    # lists
+    def __init__(self, path='assets', capacity=8, workers=2, scale=1.0, cache=None, scaler=None):
+        self.path = path
+        self.capacity = capacity
+        self.workers = workers
+        # backgrounds are scaled by scale on the loader threads as well, and
+        # the scaler is given the sprites of prefetched views there
+        self.scale = scale
+        self.cache = cache
+        self.scaler = scaler
+
+        self.files = {} # (world, loc) -> filename
+        self.built = {} # filename -> (directory, filename) to decode it from instead, see build.py
+        self.counts = {} # world -> number of locs
+        self.surfaces = OrderedDict() # (world, loc) -> [surface, converted]
+        self.pending = {} # (world, loc) -> event set once the thread loaded it
+        self.current = None # the view shown last
+        self.pinned = set() # views of the latest prefetch
+
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.threads = []
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.prefetches = 0
+        self.added = 0 # backgrounds stored, see Memory.check
+
+    # world gets num views, loaded from bg_<world>_<loc>.png unless files says otherwise
+    def add(self, world, num, files=None):
+        self.counts[world] = num
+        for loc in range(0, num):
+            self.files[(world, loc)] = files[loc] if files else 'bg_%d_%d.png' % (world, loc)
+
+    def __getitem__(self, world):
+        return BackgroundWorld(self, world)
+
+    def __contains__(self, world):
+        return world in self.counts
+
+    def __iter__(self):
+        return iter(sorted(self.counts))
+
+    def __len__(self):
+        return len(self.counts)
+
+    def decode(self, view):
+        path, name = self.built.get(self.files[view], (self.path, self.files[view]))
+        surface = pygame.image.load(os.path.join(path, name))
+        if self.scale != 1.0:
+            surface = scaled_file(path, name, surface, self.scale, self.cache)
+        return surface
+
+    # called with the lock held
+    def store(self, view, surface, converted):
+        self.surfaces[view] = [surface, converted]
+        self.added += 1
+        for old in list(self.surfaces):
+            if len(self.surfaces) <= self.capacity:
+                break
+            if old != self.current and old not in self.pinned:
+                del self.surfaces[old]
+
+    def get(self, world, loc):
+        view = (world, loc)
+        self.lock.acquire()
+        self.current = view
+        entry = self.surfaces.pop(view, None)
+        if entry:
+            self.surfaces[view] = entry
+        event = self.pending.get(view)
+        self.lock.release()
+
+        if entry:
+            self.hits += 1
+        elif event:
+            # the loader thread is on it already
+            self.waits += 1
+            event.wait()
+            self.lock.acquire()
+            entry = self.surfaces.get(view)
+            self.lock.release()
+        if not entry:
+            self.misses += 1
+            entry = [self.decode(view), False]
+
+        # converting touches the display, so it only happens here
+        if not entry[1]:
+            entry = [entry[0].convert() if pygame.display.get_surface() else entry[0], True]
+            self.lock.acquire()
+            self.store(view, entry[0], True)
+            self.lock.release()
+        return entry[0]
+
+    # queues views to be decoded on the loader thread, no more than fit
+    # next to the view shown. sprites maps views to the surfaces drawn on
+    # them, the scaler copies those of the views taken and of views not in
+    # views (the one shown) there too, the latter first
+    def prefetch(self, views, sprites=None):
+        sprites = dict(sprites or ()) if self.scaler else {}
+        jobs = [(None, sprites[view]) for view in sprites if view not in views]
+        self.lock.acquire()
+        self.pinned = set()
+        for view in views:
+            if len(self.pinned) >= self.capacity - 1:
+                break
+            if view in self.files and view not in self.pinned:
+                self.pinned.add(view)
+                if view not in self.surfaces and view not in self.pending:
+                    self.pending[view] = threading.Event()
+                    jobs.append((view, sprites.get(view, ())))
+                    self.prefetches += 1
+                elif sprites.get(view):
+                    jobs.append((None, sprites[view]))
+        self.lock.release()
+        for job in jobs:
+            self.queue.put(job)
+        while len(self.threads) < min(self.workers, self.queue.qsize()):
+            thread = threading.Thread(target=self.load)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    # runs (view, sprites) jobs: decodes the view's background, if there
+    # is a view, then has the scaler copy the sprites
+    def load(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            view, sprites = job
+            if view is not None:
+                try:
+                    surface = self.decode(view)
+                except (pygame.error, IOError):
+                    surface = None
+                self.lock.acquire()
+                if surface is not None:
+                    self.store(view, surface, False)
+                event = self.pending.pop(view)
+                self.lock.release()
+                event.set()
+            if sprites:
+                self.scaler.warm(sprites)
+
+    # ends the loader threads once they are done with what is queued
+    def stop(self):
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    # drops the least recently used background not in keep, returns the
+    # bytes it held, 0 when there is none
+    def drop(self, keep):
+        self.lock.acquire()
+        try:
+            for view in self.surfaces:
+                if view not in keep:
+                    surface = self.surfaces.pop(view)[0]
+                    return surface.get_pitch() * surface.get_height()
+        finally:
+            self.lock.release()
+        return 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'waits': self.waits,
+                'prefetches': self.prefetches, 'resident': len(self.surfaces),
+                'bytes': sum(s.get_pitch() * s.get_height() for s, c in list(self.surfaces.values()))}
+
+
+class BackgroundWorld:
+    # the views of one world, as returned by Backgrounds[world]
+    def __init__(self, backgrounds, world):
+        self.backgrounds = backgrounds
+        self.world = world
+
+    def __len__(self):
+        return self.backgrounds.counts[self.world]
+
+    def __getitem__(self, loc):
+        if not 0 <= loc < len(self):
+            raise IndexError(loc)
+        return self.backgrounds.get(self.world, loc)
+
+
+class TextCache:
+    # rendered lines of text, keyed by (text, color, size), so repeated
+    # messages don't go through the font again. holds at most capacity
+    # lines, least recently used first out
+    def __init__(self, font, size, capacity=256):
+        self.font = font
+        self.size = size
+        self.capacity = capacity
+
+        self.lines = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.added = 0 # lines rendered, see Memory.check
+
+    def render(self, text, color):
+        key = (text, tuple(color), self.size)
+        if key in self.lines:
+            self.hits += 1
+            surface = self.lines.pop(key)
+        else:
+            self.misses += 1
+            self.added += 1
+            surface = self.font.render(text, 0, color)
+        self.lines[key] = surface
+        while len(self.lines) > self.capacity:
+            self.lines.popitem(last=False)
+        return surface
+
+    # renders every line of the given '/' separated messages ahead of time
+    def warm(self, messages, color):
+        for msg in messages:
+            for line in msg.split('/'):
+                key = (line, tuple(color), self.size)
+                if key not in self.lines:
+                    self.lines[key] = self.font.render(line, 0, color)
+                    self.added += 1
+        while len(self.lines) > self.capacity:
+            self.lines.popitem(last=False)
+
+    # drops the least recently used line that isn't one of the surfaces in
+    # keep, returns the bytes it held, 0 when there is none
+    def drop(self, keep):
+        for key in self.lines:
+            if self.lines[key] not in keep:
+                surface = self.lines.pop(key)
+                return surface.get_pitch() * surface.get_height()
+        return 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'lines': len(self.lines),
+                'hit_rate': float(self.hits) / total if total else 0.0}
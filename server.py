@@ -0,0 +1,257 @@
+from __future__ import print_function
+
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import multiprocessing
+
+import pygame
+
+import main
+import replay
+import sim
+
+class Session:
+    # one independent game. only what play changes is kept here, in plain
+    # data, so a session is small and cheap to send to another process:
+    # everything else (level, objects, images) lives in the Engine
+    def __init__(self, id, script):
+        self.id = id
+        self.script = script # input, see replay.py
+
+        self.view = None # (world, loc), None until it started
+        self.player = None # [x, y, anim, interaction timer]
+        self.timer = 0.0 # message timer
+        self.inventory = {} # item -> uses
+        self.anims = {} # object -> animation, idle ones left out
+        self.removed = set()
+
+        self.entry = 0 # script position: entry, tick within it
+        self.tick = 0
+        self.ticks = 0
+        self.done = False
+        self.failures = []
+        self.state = None # sim.Simulation.state() once done
+
+    # (dt, keys, events, expect) for every tick left in the script
+    def inputs(self):
+        while self.entry < len(self.script):
+            entry = self.script[self.entry]
+            n = entry.get('ticks', 1)
+            i = 0
+            for dt, keys, events in replay.ticks(entry):
+                if i >= self.tick:
+                    self.tick = i + 1
+                    yield dt, keys, events, entry.get('expect') if i == n - 1 else None
+                i += 1
+            self.entry += 1
+            self.tick = 0
+
+
+class Engine:
+    # a headless game shared by every session of a process. a session's
+    # state is swapped in before its ticks and read back after; only the
+    # objects that differ between two sessions are touched on a swap
+    def __init__(self, level_path, dt=sim.DT):
+        self.level_path = level_path
+        self.simulation = sim.Simulation(dt, False, main.Game(level_path, headless=True))
+        self.game = self.simulation.game
+        self.current = None # session whose state the game holds
+        self.start = self.read(Session(None, []))
+        self.current = self.start
+
+    # puts a session's state into the game
+    def load(self, session):
+        if session.view is None:
+            self.copy(self.start, session)
+        game = self.game
+        objects = game.objects
+        current = self.current
+        for name in current.removed - session.removed:
+            objects.restore(objects.table[name][0])
+        for name in set(current.anims) | set(session.anims):
+            anim = session.anims.get(name, 'idle')
+            if current.anims.get(name, 'idle') != anim:
+                objects.table[name][0].set_anim(anim)
+        for name in session.removed - current.removed:
+            objects.remove(objects.table[name][0])
+        objects.changed.clear()
+
+        player = game.player
+        x, y, anim, timer = session.player
+        player.set_pos(x, y)
+        player.prev_rect = pygame.Rect(player.rect)
+        player.set_anim(anim)
+        player.timer = timer
+        player.inventory = {}
+        for item in session.inventory:
+            player.inventory[item] = {'image': main.assets.load(item + '_inv.png'), 'uses': session.inventory[item]}
+        game.world, game.loc = session.view
+        game.messages = []
+        game.timer = session.timer
+        self.current = session
+
+    # reads the game's state back into a session
+    def read(self, session):
+        game = self.game
+        objects = game.objects
+        if session is not self.current or session.view is None:
+            session.anims = {}
+            session.removed = set()
+            names = objects.table
+        else:
+            names = objects.changed
+        for name in names:
+            obj, on, present = objects.table[name]
+            session.anims.pop(name, None)
+            if obj.anim != 'idle':
+                session.anims[name] = obj.anim
+            session.removed.discard(name)
+            if not present:
+                session.removed.add(name)
+        objects.changed.clear()
+
+        player = game.player
+        session.player = [player.rect.x, player.rect.y, player.anim, player.timer]
+        session.inventory = dict((item, player.inventory[item]['uses']) for item in player.inventory)
+        session.view = (game.world, game.loc)
+        session.timer = game.timer
+        return session
+
+    def copy(self, source, session):
+        session.view = source.view
+        session.player = list(source.player)
+        session.timer = source.timer
+        session.inventory = dict(source.inventory)
+        session.anims = dict(source.anims)
+        session.removed = set(source.removed)
+
+    # steps every session in turn, batch ticks each before the next one is
+    # swapped in, until its script ends or it ran ticks ticks
+    def run(self, sessions, ticks, batch=1):
+        feeds = dict((session.id, session.inputs()) for session in sessions)
+        live = [session for session in sessions if not session.done]
+        start = time.time()
+        while live:
+            for session in live:
+                self.load(session)
+                feed = feeds[session.id]
+                for i in range(0, min(batch, ticks - session.ticks)):
+                    try:
+                        dt, keys, events, expect = next(feed)
+                    except StopIteration:
+                        session.done = True
+                        break
+                    running = self.simulation.tick(keys, events, dt)
+                    session.ticks += 1
+                    if expect:
+                        session.failures.extend(self.simulation.check(expect))
+                    if not running:
+                        session.done = True
+                        break
+                if session.ticks >= ticks:
+                    session.done = True
+                self.read(session)
+                if session.done:
+                    session.state = self.simulation.state()
+            live = [session for session in live if not session.done]
+        return sessions, time.time() - start
+
+
+# the engine of this process, built by the first shard it runs
+engine = None
+
+def run_shard(args):
+    global engine
+    level_path, dt, sessions, ticks, batch = args
+    start = time.time()
+    if engine is None or engine.level_path != level_path:
+        engine = Engine(level_path, dt)
+    setup = time.time() - start
+    sessions, seconds = engine.run(sessions, ticks, batch)
+    return sessions, setup, seconds
+
+# input for a session without a script: walking about and pressing space
+def random_script(seed, ticks):
+    rng = random.Random(seed)
+    script = []
+    total = 0
+    while total < ticks:
+        entry = {'ticks': rng.randint(10, 90)}
+        keys = rng.choice([[], ['left'], ['right'], ['up'], ['down'], ['left', 'up'], ['right', 'down']])
+        if keys:
+            entry['keys'] = keys
+        if rng.random() < 0.5:
+            entry['press'] = ['space']
+        script.append(entry)
+        total += entry['ticks']
+    return script
+
+
+class Server:
+    # runs many sessions of one level over a pool of worker processes. the
+    # sessions are split into one shard per worker, each worker steps its
+    # shard with a single Engine. workers=0 runs everything in this process
+    def __init__(self, level_path=os.path.join('levels', 'main.json'), workers=None, dt=sim.DT, batch=1):
+        self.level_path = level_path
+        self.workers = multiprocessing.cpu_count() if workers is None else workers
+        self.dt = dt
+        self.batch = batch
+
+    def run(self, sessions, ticks):
+        n = max(1, self.workers)
+        shards = [sessions[i::n] for i in range(0, n) if sessions[i::n]]
+        tasks = [(self.level_path, self.dt, shard, ticks, self.batch) for shard in shards]
+        start = time.time()
+        if self.workers == 0:
+            results = [run_shard(task) for task in tasks]
+        else:
+            pool = multiprocessing.Pool(len(tasks))
+            results = pool.map(run_shard, tasks)
+            pool.close()
+            pool.join()
+        seconds = time.time() - start
+
+        done = []
+        for shard, setup, stepping in results:
+            done.extend(shard)
+        done.sort(key=lambda session: session.id)
+        session_ticks = sum(session.ticks for session in done)
+        stepping = max([r[2] for r in results] + [0.0])
+        return {'sessions': len(done), 'workers': len(tasks), 'batch': self.batch,
+                'session_ticks': session_ticks, 'seconds': seconds,
+                'setup_s': max([r[1] for r in results] + [0.0]),
+                # sessions x ticks per second, wall clock including setup, and
+                # stepping alone (the slowest worker)
+                'throughput': session_ticks / seconds if seconds else 0.0,
+                'step_throughput': session_ticks / stepping if stepping else 0.0,
+                'failures': dict((session.id, session.failures) for session in done if session.failures),
+                'results': done}
+
+
+def run(argv):
+    parser = argparse.ArgumentParser(description='run many headless game sessions at once')
+    parser.add_argument('--level', default=os.path.join('levels', 'main.json'))
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--ticks', type=int, default=600, help='ticks to run each session for at most')
+    parser.add_argument('--workers', type=int, help='processes to use, 0 runs in this one (default: one per cpu)')
+    parser.add_argument('--batch', type=int, default=1, help='ticks a session runs before the next is swapped in')
+    parser.add_argument('--script', help='input script every session plays, random input by default')
+    parser.add_argument('--states', action='store_true', help='include the final state of every session')
+    args = parser.parse_args(argv)
+
+    script = replay.load(args.script) if args.script else None
+    sessions = [Session(i, script or random_script(i, args.ticks)) for i in range(0, args.sessions)]
+    server = Server(args.level, args.workers, sim.DT, args.batch)
+    result = server.run(sessions, args.ticks)
+    results = result.pop('results')
+    if args.states:
+        result['states'] = dict((session.id, session.state) for session in results)
+    print(json.dumps(result, indent=2, sort_keys=True))
+    return 1 if result['failures'] else 0
+
+if __name__=='__main__':
+    sys.exit(run(sys.argv[1:]))
@@ -0,0 +1,109 @@
+from __future__ import print_function
+
+import os
+import sys
+import time
+import json
+import argparse
+
+import pygame
+
+import main
+import replay
+
+# one frame at 60fps, in the units Game.step takes dt in
+DT = 1000.0 / 60 / 50
+
+# runs the game without a real display or sound card
+def init():
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    pygame.init()
+
+class Simulation:
+    # steps a game as fast as possible with a fixed dt, drawing to the
+    # dummy display only when draw is set
+    def __init__(self, dt=DT, draw=False, game=None):
+        init()
+        self.game = game or main.Game()
+        self.game.setup()
+        self.dt = dt
+        self.draw = draw
+        self.ticks = 0
+
+    def tick(self, keys, events, dt=None):
+        running = self.game.step(dt or self.dt, keys, events)
+        if self.draw:
+            self.game.draw()
+        self.ticks += 1
+        return running
+
+    def state(self):
+        return {'world': self.game.world, 'loc': self.game.loc,
+                'x': self.game.player.rect.x, 'y': self.game.player.rect.y,
+                'inventory': sorted(self.game.player.inventory),
+                'removed': sorted(name for name in self.game.objects.table
+                                  if not self.game.objects.present(name))}
+
+    # compares the expected values of a script entry with the game state
+    def check(self, expect):
+        state = self.state()
+        failures = []
+        for key in sorted(expect):
+            want = expect[key]
+            if key == 'inventory':
+                want = sorted(want)
+            if state.get(key) != want:
+                failures.append('%s: expected %r, got %r' % (key, want, state.get(key)))
+        return failures
+
+    # plays a script, recorded dt values are used unless fixed is set
+    def run(self, script, fixed=False):
+        failures = []
+        ticks = self.ticks
+        running = True
+        start = time.time()
+        for entry in script:
+            for dt, keys, events in replay.ticks(entry):
+                running = self.tick(keys, events, None if fixed else dt)
+                if not running:
+                    break
+            if 'expect' in entry:
+                failures.extend(self.check(entry['expect']))
+            if not running:
+                break
+        seconds = time.time() - start
+        ticks = self.ticks - ticks
+        return {'ticks': ticks, 'seconds': seconds,
+                'tps': ticks / seconds if seconds else 0.0,
+                'failures': failures, 'state': self.state()}
+
+
+def run(argv):
+    parser = argparse.ArgumentParser(description='replay an input script headless')
+    parser.add_argument('script')
+    parser.add_argument('--dt', type=float, default=DT, help='fixed tick length')
+    parser.add_argument('--fixed', action='store_true', help='ignore recorded frame times')
+    parser.add_argument('--draw', action='store_true', help='render every tick too')
+    parser.add_argument('--start', help='snapshot to start from instead of the level start')
+    parser.add_argument('--save', help='write a snapshot of the final state here')
+    parser.add_argument('--trace', help='write per-phase timings here, chrome://tracing format')
+    parser.add_argument('--scale', type=float, default=1.0, help='draw at this multiple of 800x600')
+    parser.add_argument('--scale-cache', help='keep scaled images in this directory')
+    args = parser.parse_args(argv)
+
+    simulation = Simulation(args.dt, args.draw, main.Game(trace=args.trace, scale=args.scale, scale_cache=args.scale_cache))
+    if args.start:
+        simulation.game.load_snapshot(args.start)
+    result = simulation.run(replay.load(args.script), args.fixed)
+    if args.save:
+        simulation.game.save_snapshot(args.save)
+    if args.trace:
+        result['phases'] = simulation.game.profiler.summary()
+        simulation.game.profiler.save_trace(args.trace)
+    simulation.game.close()
+    print(json.dumps(result, indent=2, sort_keys=True))
+    return 1 if result['failures'] else 0
+
+if __name__=='__main__':
+    sys.exit(run(sys.argv[1:]))
@@ -0,0 +1,459 @@
+from __future__ import print_function
+
+import sys
+import time
+import json
+import argparse
+from collections import deque
+
+import pygame
+
+import level
+import main
+from main import KEPT, Interactions
+
+# screen size and view border the game plays with, see Game.setup and Player
+WIDTH, HEIGHT = 800, 600
+BORDER = 50
+
+class Puzzle:
+    # the static side of a level, precomputed once: which objects the
+    # player can touch on each view and which ones cover them, where
+    # walking off a view leads and the swaps. search states only hold what
+    # interactions change and something later depends on:
+    #   (view, inventory, toggled on, gone)
+    # inventory is a sorted tuple of (item, uses) of the items some object
+    # or swap needs, toggled on the toggles some object has as a parent or
+    # that change shape when toggled (see toggles) and gone the objects taken that something depends on (see lasting), both
+    # frozensets. the player touches an object when its rect overlaps a
+    # pixel of the object's sprite, as in Interactions.candidates
+    def __init__(self, data, goal=None):
+        self.data = data
+        self.goal = goal or data.get('goal')
+        self.objects = data['objects']
+        self.names = set(spec['name'] for spec in self.objects)
+        self.start = tuple(data['start'])
+
+        self.restr = {}
+        for view in level.views(data):
+            self.restr[view] = {'left': 0, 'right': WIDTH, 'top': 0, 'bot': HEIGHT}
+        for restr in data.get('restrictions', ()):
+            self.restr[tuple(restr['view'])] = {
+                'left': restr.get('left', 0), 'right': WIDTH - restr.get('right', 0),
+                'top': restr.get('top', 0), 'bot': HEIGHT - restr.get('bot', 0)}
+
+        self.swaps = {}
+        for swap in data.get('swaps', ()):
+            self.swaps[swap['at']] = (swap['from'], swap['to'], swap.get('uses', 1))
+
+        # Interactions only uses the first object the player touches: higher
+        # layers first, then by type, then the one added to the level first
+        priority = Interactions.PRIORITY
+        self.rank = {}
+        for seq, spec in enumerate(self.objects):
+            typ = priority.index(spec['type']) if spec['type'] in priority else len(priority)
+            self.rank[spec['name']] = (-spec.get('layer', 0), typ, seq)
+
+        self.here = {} # view -> objects the player can walk up to, first used first
+        self.areas = {} # name -> where the player touches it in any of its frames, see area
+        self.shapes = {} # toggle -> where it is touched when 'idle', 'on' and both, None if nowhere
+        self.untouchable = []
+        for spec in self.objects:
+            area = self.area(spec)
+            if not area:
+                self.untouchable.append(spec['name'])
+                continue
+            self.here.setdefault(tuple(spec['view']), []).append(spec)
+            self.areas[spec['name']] = area
+            if spec['type'] == 'toggle' and 'on' in [anim for anim, row, num in spec.get('frames', ())]:
+                idle, on = self.area(spec, ['idle']), self.area(spec, ['on'])
+                both = None
+                if idle and on:
+                    both = (idle[0].overlap_mask(on[0], (on[1] - idle[1], on[2] - idle[2])), idle[1], idle[2])
+                self.shapes[spec['name']] = {'idle': idle, 'on': on, 'both': both if both and both[0].count() else None}
+        # name -> objects ranked before it the player can touch along with it
+        self.above = {}
+        for view in self.here:
+            self.here[view].sort(key=lambda spec: self.rank[spec['name']])
+            names = [spec['name'] for spec in self.here[view]]
+            for i, name in enumerate(names):
+                self.above[name] = [other for other in names[:i] if self.meets(self.areas[name], self.areas[other])]
+        self.reached = {} # arguments of reachable -> whether the object can be used then
+        # objects the player can always get to on their own don't depend on what is above them
+        for name in self.above:
+            if self.reachable(name, (), sure=True):
+                self.above[name] = []
+
+        # only objects the goal depends on are searched, the others can't
+        # help or hinder finishing
+        self.relevant = self.depends()
+        relevant = [spec for spec in self.objects if spec['name'] in self.relevant]
+        # uses beyond what every object and swap needing an item could take
+        # can't matter, capping them keeps repeated toggles from making
+        # endless new states. items nothing needs aren't kept at all
+        self.caps = {}
+        for spec in relevant:
+            for req in spec.get('reqs', ()):
+                self.caps[req] = self.caps.get(req, 1) + 1
+            for item in self.swaps.get(spec['name'], ((),))[0]:
+                self.caps[item] = self.caps.get(item, 1) + 1
+        # toggles whose state is kept: parents, and the ones where the player
+        # can touch them or what they cover depends on it. toggling anything
+        # else only matters for its swap
+        self.toggles = set(parent for spec in relevant for parent in spec.get('parents', ()))
+        self.toggles.update(name for name in self.relevant if name in self.shapes)
+        # objects whose going away matters: something waits on them or is
+        # covered by them, they hand out or take needed items or swap.
+        # taking the rest changes nothing later moves depend on
+        self.lasting = set(unreq for spec in relevant for unreq in spec.get('unreqs', ()))
+        for spec in relevant:
+            self.lasting.update(self.above.get(spec['name'], ()))
+            if spec['name'] in self.caps or spec.get('reqs') or spec['name'] in self.swaps:
+                self.lasting.add(spec['name'])
+        self.possible = None # relevant objects relaxed says can be used, set by solve
+
+    # the objects the goal can depend on: the goal and every door, then
+    # whatever one of them waits on, has as a parent or is covered by, and
+    # whatever hands out or uses up an item one of them needs
+    def depends(self):
+        specs = dict((spec['name'], spec) for spec in self.objects)
+        if self.goal not in specs:
+            return set(specs)
+        providers, takers = {}, {} # item -> objects handing it out, using it up
+        for name in specs:
+            if specs[name]['type'] == 'pickup':
+                providers.setdefault(name, []).append(name)
+            for req in specs[name].get('reqs', ()):
+                if req not in KEPT:
+                    takers.setdefault(req, []).append(name)
+        for at in self.swaps:
+            for item in self.swaps[at][0]:
+                takers.setdefault(item, []).append(at)
+            for item in self.swaps[at][1]:
+                providers.setdefault(item, []).append(at)
+
+        relevant, items = set(), set()
+        todo = [self.goal] + [name for name in specs if specs[name]['type'] == 'door']
+        while todo:
+            name = todo.pop()
+            if name in relevant or name not in specs:
+                continue
+            relevant.add(name)
+            spec = specs[name]
+            for item in list(spec.get('reqs', ())) + list(self.swaps.get(name, ((),))[0]):
+                if item not in items:
+                    items.add(item)
+                    todo.extend(providers.get(item, ()))
+                    todo.extend(takers.get(item, ()))
+            todo.extend(spec.get('parents', ()))
+            todo.extend(spec.get('unreqs', ()))
+            todo.extend(self.above.get(name, ()))
+        return relevant
+
+    # the player positions (top left, within the view's movement
+    # restrictions) at which its rect overlaps a pixel of the object, as
+    # (mask, x, y) with bit (i, j) of the mask standing for the player at
+    # (x + i, y + j), None if there are none. the frames of the given
+    # anims count, by default every one the object can show
+    def area(self, spec, anims=None):
+        view = tuple(spec['view'])
+        if view not in self.restr:
+            return None
+        r = self.restr[view]
+        pw, ph = self.data['player']['size']
+        x, y = spec['pos']
+        # the player's centerx stays within left..right, its bottom within top..bot
+        xmin, xmax = r['left'] - pw // 2, max(r['left'], r['right']) - pw // 2
+        ymin, ymax = r['top'] - ph, max(r['top'], r['bot']) - ph
+        allowed = pygame.Rect(xmin, ymin, xmax - xmin + 1, ymax - ymin + 1)
+        # player positions overlapping the object's rect
+        near = pygame.Rect(x - pw + 1, y - ph + 1, spec['size'][0] + pw - 1, spec['size'][1] + ph - 1)
+        clip = near.clip(allowed)
+        if not clip.width or not clip.height:
+            return None
+
+        w, h = spec['size']
+        rows = dict((anim, (row, num)) for anim, row, num in spec.get('frames', ()))
+        rows.setdefault('idle', (0, 2))
+        if anims is None:
+            anims = ['idle', 'on'] if spec['type'] == 'toggle' and 'on' in rows else ['idle']
+        pixels = pygame.mask.Mask((w, h))
+        for anim in anims:
+            frames = main.assets.frames(spec['image'], w, h, rows[anim][0], rows[anim][1])
+            pixels.draw(main.assets.union_mask(frames), (0, 0))
+        # widening the pixels by the player's width, then its height, marks
+        # every position whose rect holds one of them
+        touch = pixels.convolve(pygame.mask.Mask((pw, 1), True)).convolve(pygame.mask.Mask((1, ph), True))
+        area = pygame.mask.Mask(clip.size)
+        area.draw(touch, (near.x - clip.x, near.y - clip.y))
+        if not area.count():
+            return None
+        return (area, clip.x, clip.y)
+
+    @staticmethod
+    def meets(a, b):
+        return a[0].overlap(b[0], (b[1] - a[1], b[2] - a[2])) is not None
+
+    # where the player touches an object: with on given, a toggle as it is
+    # shown then. otherwise in any of its frames if most is set, else only
+    # where every frame is touched
+    def shape(self, name, on, most):
+        if name not in self.shapes:
+            return self.areas[name]
+        if on is not None:
+            return self.shapes[name]['on' if name in on else 'idle']
+        return self.areas[name] if most else self.shapes[name]['both']
+
+    # whether the player can stand somewhere touching the object while
+    # touching none of the objects above it that are still in the world.
+    # without on, toggles may show either frames: sure says whether that
+    # must hold whichever they show or just for some
+    def reachable(self, name, gone, on=None, sure=False):
+        above = tuple(other for other in self.above[name] if other not in gone)
+        shown = None if on is None else tuple(other for other in (name,) + above if other in on)
+        key = (name, above, shown, sure)
+        if key not in self.reached:
+            area = self.shape(name, on, not sure)
+            free = None
+            if area:
+                mask, x, y = area
+                free = pygame.mask.Mask(mask.get_size())
+                free.draw(mask, (0, 0))
+                for other in above:
+                    cover = self.shape(other, on, sure)
+                    if cover:
+                        free.erase(cover[0], (cover[1] - x, cover[2] - y))
+            self.reached[key] = bool(free and free.count())
+        return self.reached[key]
+
+    # views walking off the left or right edge of a view leads to
+    def neighbours(self, view):
+        world, loc = view
+        num = self.data['worlds'][world]
+        if num == 1:
+            return []
+        out = []
+        r = self.restr[view]
+        if r['left'] < BORDER:
+            out.append((world, (loc - 1) % num))
+        if r['right'] > WIDTH - BORDER:
+            out.append((world, (loc + 1) % num))
+        return out
+
+    def initial(self):
+        return (self.start, (), frozenset(), frozenset())
+
+    def cap(self, inv):
+        return tuple(sorted((item, min(uses, self.caps[item])) for item, uses in inv.items() if item in self.caps))
+
+    # Object.can_use: the inventory after using the object, None if it can't be
+    def can_use(self, spec, inv, on, gone):
+        inv = dict(inv)
+        if spec.get('breaks'):
+            return None
+        for req in spec.get('reqs', ()):
+            if req not in inv:
+                return None
+        for unreq in spec.get('unreqs', ()):
+            if unreq in self.names and unreq not in gone:
+                return None
+        for parent in spec.get('parents', ()):
+            if parent in self.names and parent not in gone and parent not in on:
+                return None
+        for req in spec.get('reqs', ()):
+            if req not in KEPT:
+                inv[req] -= 1
+                if inv[req] <= 0:
+                    inv.pop(req)
+        return inv
+
+    # Player.check_swaps
+    def swap(self, name, inv):
+        if name not in self.swaps:
+            return
+        f, t, uses = self.swaps[name]
+        for item in f:
+            if item not in inv:
+                return
+        for item in f:
+            inv[item] -= 1
+            if inv[item] <= 0:
+                inv.pop(item)
+        for item in t:
+            inv[item] = uses
+
+    # (action, state) for every move that changes something
+    def moves(self, state):
+        view, inv, on, gone = state
+        for nview in self.neighbours(view):
+            yield ('walk', '%d,%d' % nview), (nview, inv, on, gone)
+        for spec in self.here.get(view, ()):
+            name = spec['name']
+            if name not in self.possible or name in gone or not self.reachable(name, gone, on):
+                continue
+            new = self.can_use(spec, inv, on, gone)
+            if new is None:
+                continue
+            self.swap(name, new)
+            nview, non, ngone = view, on, gone
+            typ = spec['type']
+            if typ in ('pickup', 'use') and name in self.lasting:
+                if typ == 'pickup':
+                    new[name] = spec.get('uses', 1)
+                ngone = gone | set([name])
+            elif typ == 'toggle' and name in self.toggles:
+                non = on ^ set([name])
+            elif typ == 'door':
+                nview = tuple(spec['to'])
+            nstate = (nview, self.cap(new), non, ngone)
+            if nstate != state or name == self.goal:
+                yield (typ, name), nstate
+
+    # breadth first search for the shortest way to use the goal object.
+    # with explore set, every reachable state is visited so dead ends can
+    # be counted
+    def solve(self, max_states=1000000, explore=False):
+        if self.possible is None:
+            self.possible = self.relaxed()['used'] & self.relevant
+        start = self.initial()
+        parents = {start: None}
+        edges = {}
+        queue = deque([start])
+        goal = None
+        finishing = [] # states the goal can be used from
+        complete = True
+        while queue:
+            state = queue.popleft()
+            out = []
+            for action, nstate in self.moves(state):
+                if action[1] == self.goal:
+                    finishing.append(state)
+                    if goal is None:
+                        goal = (state, action)
+                    if not explore:
+                        break
+                out.append(nstate)
+                if nstate not in parents:
+                    if len(parents) >= max_states:
+                        complete = False
+                        break
+                    parents[nstate] = (state, action)
+                    queue.append(nstate)
+            edges[state] = out
+            if (goal and not explore) or not complete:
+                break
+
+        solution = None
+        if goal:
+            state, action = goal
+            solution = [action]
+            while parents[state]:
+                state, action = parents[state]
+                solution.append(action)
+            solution.reverse()
+
+        result = {'states': len(parents), 'complete': complete and (explore or goal is None),
+                  'solvable': True if goal else (False if complete else None), 'solution': solution}
+        if explore and complete:
+            result['dead_ends'] = self.dead_ends(edges, finishing)
+        return result
+
+    # states from which the goal can no longer be reached
+    def dead_ends(self, edges, finishing):
+        back = {}
+        for state in edges:
+            for nstate in edges[state]:
+                back.setdefault(nstate, []).append(state)
+        alive = set(finishing)
+        queue = deque(alive)
+        while queue:
+            for prev in back.get(queue.popleft(), ()):
+                if prev not in alive:
+                    alive.add(prev)
+                    queue.append(prev)
+        return len([state for state in edges if state not in alive])
+
+    # reachability ignoring everything that takes away (used up items,
+    # toggling off, unreqs) and taking objects out of the way as soon as
+    # they could be: cheap even for huge levels, and anything it can't
+    # reach can never be reached
+    def relaxed(self):
+        views = set([self.start])
+        items, on, used = set(), set(), set()
+        taken = set() # used objects that are gone from the world
+        changed = True
+        while changed:
+            changed = False
+            for view in list(views):
+                for nview in self.neighbours(view):
+                    if nview not in views:
+                        views.add(nview)
+                        changed = True
+                for spec in self.here.get(view, ()):
+                    name = spec['name']
+                    if name in used or not self.reachable(name, taken):
+                        continue
+                    if not set(spec.get('reqs', ())) <= items or spec.get('breaks'):
+                        continue
+                    if [p for p in spec.get('parents', ()) if p in self.names and p not in on and p not in used]:
+                        continue
+                    used.add(name)
+                    changed = True
+                    if spec['type'] in ('pickup', 'use'):
+                        taken.add(name)
+                    if spec['type'] == 'pickup':
+                        items.add(name)
+                    if spec['type'] == 'toggle':
+                        on.add(name)
+                    if spec['type'] == 'door':
+                        views.add(tuple(spec['to']))
+                    if name in self.swaps:
+                        f, t, uses = self.swaps[name]
+                        if set(f) <= items:
+                            items.update(t)
+            # swaps at objects already used can still fire once their inputs show up
+            for name in used:
+                if name in self.swaps and set(self.swaps[name][0]) <= items and not set(self.swaps[name][1]) <= items:
+                    items.update(self.swaps[name][1])
+                    changed = True
+        return {'views': views, 'items': items, 'used': used,
+                'unreachable_views': sorted(set(self.restr) - views),
+                'unusable': sorted(self.names - used - set(self.untouchable)),
+                'untouchable': sorted(self.untouchable)}
+
+
+def report(path, goal=None, max_states=1000000, explore=False):
+    start = time.time()
+    puzzle = Puzzle(level.load(path), goal)
+    relaxed = puzzle.relaxed()
+    out = {'level': path, 'goal': puzzle.goal, 'objects': len(puzzle.objects),
+           'unreachable_views': [list(v) for v in relaxed['unreachable_views']],
+           'unusable': relaxed['unusable'], 'untouchable': relaxed['untouchable']}
+    if puzzle.goal is None:
+        out['solvable'] = None
+    elif puzzle.goal not in relaxed['used']:
+        # not even the relaxed level gets there, no need to search
+        out.update({'solvable': False, 'solution': None, 'states': 0, 'complete': True})
+    else:
+        out.update(puzzle.solve(max_states, explore))
+        if out['solution']:
+            out['steps'] = len(out['solution'])
+            out['solution'] = ['%s %s' % action for action in out['solution']]
+    out['seconds'] = time.time() - start
+    return out
+
+def run(argv):
+    parser = argparse.ArgumentParser(description='check that levels can be finished')
+    parser.add_argument('levels', nargs='+')
+    parser.add_argument('--goal', help='object to use last, defaults to the level goal')
+    parser.add_argument('--max-states', type=int, default=1000000)
+    parser.add_argument('--dead-ends', action='store_true', help='explore every state and count dead ends')
+    args = parser.parse_args(argv)
+
+    reports = [report(path, args.goal, args.max_states, args.dead_ends) for path in args.levels]
+    print(json.dumps(reports, indent=2, sort_keys=True))
+    # levels the search gave up on (solvable None) aren't failures
+    return 1 if [r for r in reports if r['solvable'] is False] else 0
+
+if __name__=='__main__':
+    sys.exit(run(sys.argv[1:]))
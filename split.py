@@ -0,0 +1,191 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import struct
+import argparse
+import multiprocessing
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None # python 3.8 and up only
+
+import pygame
+
+import main
+import replay
+from profiler import clock
+from resources import Scaler
+
+# the game split over two processes: a worker loads the assets, steps the
+# simulation and composes frames, while this process only polls input and
+# presents whatever frame is newest, so a slow frame never holds up
+# reading the keyboard. input goes to the worker as replay entries on a
+# queue, frames come back through shared memory: a header and two frame
+# buffers, the worker composes into the one the header doesn't point at
+# and swaps them under a lock the presenter holds while it copies.
+#   header: front buffer, frames composed, last input seq they show, running
+HEADER = struct.Struct('<4q')
+
+def frame_buffers(shm, size):
+    n = size[0] * size[1] * 4
+    return [pygame.image.frombuffer(shm.buf[HEADER.size + i * n:HEADER.size + (i + 1) * n], size, 'BGRA')
+            for i in range(0, 2)]
+
+# the worker process: a Game drawing to the dummy display, stepped with
+# the fixed dt of Game.main on input from the queue
+def work(level_path, scale, fps, name, size, lock, inputs):
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    pygame.display.init()
+    pygame.font.init()
+    shm = shared_memory.SharedMemory(name)
+    buffers = frame_buffers(shm, size)
+    game = main.Game(level_path, fps=fps, scale=scale)
+    game.setup()
+
+    timer = pygame.time.Clock()
+    accumulator = 0.0
+    keys, events = replay.Keys(), []
+    latest = consumed = 0
+    frame, back = 0, 1
+    running = True
+    while running:
+        dt = timer.tick(fps) / 50.0
+        accumulator = min(accumulator + dt, game.dt * game.max_steps)
+        while True:
+            try:
+                seq, entry = inputs.get_nowait()
+            except queue.Empty:
+                break
+            for d, keys, new in replay.ticks(entry):
+                events.extend(new)
+            latest = seq
+
+        while running and accumulator >= game.dt:
+            running = game.step(game.dt, keys, events)
+            events = []
+            accumulator -= game.dt
+            consumed = latest
+
+        if running:
+            game.draw(accumulator / game.dt)
+            game.audio.update()
+            buffers[back].blit(game.screen, (0, 0))
+            frame += 1
+            lock.acquire()
+            HEADER.pack_into(shm.buf, 0, back, frame, consumed, 1)
+            lock.release()
+            back = 1 - back
+
+    lock.acquire()
+    HEADER.pack_into(shm.buf, 0, 1 - back, frame, consumed, 0)
+    lock.release()
+    del buffers
+    shm.close()
+
+
+class Split:
+    # the presenting side. latencies are input to photon: from the frame an
+    # input was polled on to the flip of the first frame the worker
+    # composed after stepping with it. only presses and changes of the
+    # held keys are timed, holding a key still is not new input
+    def __init__(self, level_path=os.path.join('levels', 'main.json'), scale=1.0, fps=60):
+        if shared_memory is None:
+            raise RuntimeError('running the game split needs multiprocessing.shared_memory (python 3.8+)')
+        self.level_path = level_path
+        self.scale = scale
+        self.fps = fps
+
+        self.latencies = []
+        self.presented = 0
+        self.composed = 0
+
+    def main(self):
+        pygame.display.init()
+        if self.scale is None:
+            self.scale = main.Game.fit()
+        size = Scaler(main.assets, self.scale).to_screen(*main.Game.SIZE)
+        screen = pygame.display.set_mode(size)
+        pygame.display.set_caption('disconnected worlds')
+
+        shm = shared_memory.SharedMemory(create=True, size=HEADER.size + size[0] * size[1] * 4 * 2)
+        HEADER.pack_into(shm.buf, 0, 0, 0, 0, 1)
+        buffers = frame_buffers(shm, size)
+        # a forked worker would share this process' display, it starts fresh
+        context = multiprocessing.get_context('spawn')
+        lock = context.Lock()
+        inputs = context.Queue()
+        worker = context.Process(target=work, args=(self.level_path, self.scale, self.fps,
+                                                            shm.name, size, lock, inputs))
+        worker.start()
+
+        timer = pygame.time.Clock()
+        pending = {} # input seq -> when it was polled
+        seq, held, shown = 0, None, 0
+        try:
+            while worker.is_alive():
+                timer.tick(self.fps)
+                entry = replay.record(None, pygame.key.get_pressed(), pygame.event.get())
+                seq += 1
+                if 'press' in entry or 'quit' in entry or entry.get('keys') != held:
+                    pending[seq] = clock()
+                held = entry.get('keys')
+                inputs.put((seq, entry))
+
+                lock.acquire()
+                front, frame, consumed, running = HEADER.unpack_from(shm.buf, 0)
+                if frame != shown:
+                    screen.blit(buffers[front], (0, 0))
+                lock.release()
+                if not running:
+                    break
+                if frame != shown:
+                    pygame.display.flip()
+                    now = clock()
+                    for n in [n for n in pending if n <= consumed]:
+                        self.latencies.append(now - pending.pop(n))
+                    self.presented += 1
+                    self.composed = frame
+                    shown = frame
+        finally:
+            worker.join(5)
+            if worker.is_alive():
+                worker.terminate()
+            del buffers
+            shm.close()
+            shm.unlink()
+        return self.stats()
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+        return {'composed': self.composed, 'presented': self.presented, 'inputs': len(latencies),
+                'latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                               'max': percentile(1.0)}}
+
+
+def run(argv):
+    parser = argparse.ArgumentParser(description='play with simulation and drawing in a worker process')
+    parser.add_argument('--level', default=os.path.join('levels', 'main.json'))
+    parser.add_argument('--scale', default='1', help="multiple of 800x600 to draw at, 'fit' fills the display")
+    parser.add_argument('--fps', type=int, default=60)
+    parser.add_argument('--out', help='write the input to photon latencies here')
+    args = parser.parse_args(argv)
+
+    scale = None if args.scale == 'fit' else float(args.scale)
+    stats = Split(args.level, scale, args.fps).main()
+    if args.out:
+        f = open(args.out, 'w')
+        json.dump(stats, f, indent=2, sort_keys=True)
+        f.close()
+    print(json.dumps(stats, indent=2, sort_keys=True))
+    return 0
+
+if __name__=='__main__':
+    sys.exit(run(sys.argv[1:]))
@@ -0,0 +1,132 @@
+import weakref
+from array import array
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# a frame set, a dict so it can be weakly referenced
+class FrameSet(dict):
+    pass
+
+class ObjectStore:
+    # the state objects change while the game runs, kept as one array per
+    # field (position, view, animation, frame and frame time) instead of
+    # attributes on every object. an object only holds its slot number.
+    # animation names become small ids, and strings and frame tables that
+    # many objects share are kept once. a slot is freed with its object
+    FIELDS = ['x', 'y', 'world', 'loc', 'anim', 'frame', 'frametime', 'count', 'period']
+
+    # animating fewer slots than this isn't worth going through numpy
+    VECTOR_MIN = 128
+
+    def __init__(self):
+        self.x = array('i')
+        self.y = array('i')
+        self.world = array('i') # -1 for objects seen on every view
+        self.loc = array('i')
+        self.anim = array('h')
+        self.frame = array('h')
+        self.frametime = array('d')
+        self.count = array('h') # frames in the current animation
+        self.period = array('d') # frame time each frame is shown for
+
+        self.vectors = None # numpy views of the arrays, see arrays()
+
+        self.free = [] # slots of objects that are gone
+        self.slots = {} # weak reference to an object -> its slot
+        self.callback = self.release # one bound method for every reference
+
+        self.names = [] # animation id -> name
+        self.ids = {} # animation name -> id
+        self.strings = {}
+        # frame sets in use, an entry goes away with the last object using it
+        # and with it the frames (and atlas pages) it holds
+        self.frame_sets = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self.x) - len(self.free)
+
+    def add(self, obj):
+        if self.free:
+            slot = self.free.pop()
+            self.x[slot] = self.y[slot] = 0
+            self.world[slot] = self.loc[slot] = -1
+            self.anim[slot] = self.frame[slot] = self.count[slot] = 0
+            self.frametime[slot] = 0.0
+            self.period[slot] = obj.frametime_max
+        else:
+            # arrays can't grow while numpy looks at them
+            self.vectors = None
+            slot = len(self.x)
+            self.x.append(0)
+            self.y.append(0)
+            self.world.append(-1)
+            self.loc.append(-1)
+            self.anim.append(0)
+            self.frame.append(0)
+            self.frametime.append(0.0)
+            self.count.append(0)
+            self.period.append(obj.frametime_max)
+        self.slots[weakref.ref(obj, self.callback)] = slot
+        return slot
+
+    # called when an object is collected
+    def release(self, ref):
+        slot = self.slots.pop(ref, None)
+        if slot is not None:
+            self.free.append(slot)
+
+    def anim_id(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    # one copy of every equal string
+    def intern(self, text):
+        return self.strings.setdefault(text, text)
+
+    # frames is an object's {anim: frame list} with anim added. objects
+    # with the same frame lists share one dict, so it must not be changed
+    # in place
+    def frame_set(self, frames, anim, frame_list):
+        frames = FrameSet(frames)
+        frames[anim] = frame_list
+        key = tuple(sorted((name, id(frames[name])) for name in frames))
+        return self.frame_sets.setdefault(key, frames)
+
+    # numpy arrays sharing memory with the store's arrays
+    def arrays(self):
+        if self.vectors is None:
+            self.vectors = {}
+            for field in self.FIELDS:
+                a = getattr(self, field)
+                self.vectors[field] = numpy.frombuffer(a, a.typecode)
+        return self.vectors
+
+    # advances the frames of the given slots by dt: each slot shows a
+    # frame for its period, then moves on to the next of count frames.
+    # with numpy and enough slots this is one pass over all of them
+    def animate(self, slots, dt):
+        if numpy is not None and len(slots) >= self.VECTOR_MIN:
+            a = self.arrays()
+            slots = numpy.asarray(slots, numpy.intp)
+            frametime = a['frametime'][slots] + dt
+            frame = a['frame'][slots]
+            count = a['count'][slots]
+            over = (frametime > a['period'][slots]) & (count > 0)
+            a['frame'][slots] = numpy.where(over, (frame + 1) % numpy.maximum(count, 1), frame)
+            a['frametime'][slots] = numpy.where(over, 0.0, frametime)
+            return
+        frametimes, frames, counts, periods = self.frametime, self.frame, self.count, self.period
+        for slot in slots:
+            frametime = frametimes[slot] + dt
+            if frametime > periods[slot] and counts[slot]:
+                frames[slot] = (frames[slot] + 1) % counts[slot]
+                frametime = 0.0
+            frametimes[slot] = frametime
+
+    # bytes held by the arrays
+    def bytes(self):
+        return sum(getattr(self, field).itemsize * len(getattr(self, field)) for field in self.FIELDS)
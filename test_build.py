@@ -0,0 +1,67 @@
+import os
+import glob
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+import sim
+import build
+
+LEVELS = sorted(glob.glob(os.path.join('levels', '*.json')))
+
+# every file under path with the hash of its contents
+def tree(path):
+    files = {}
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            f = open(os.path.join(root, name), 'rb')
+            files[os.path.join(root, name)] = hashlib.sha1(f.read()).hexdigest()
+            f.close()
+    return files
+
+def pixels(surface):
+    return sim.pygame.image.tostring(surface, 'RGBA')
+
+# builds into a fresh directory and checks what comes out against the
+# committed pngs in assets/
+class TestBuild(unittest.TestCase):
+    def setUp(self):
+        sim.init()
+        self.out = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out)
+
+    def test_writes_only_to_out(self):
+        before = [tree('assets'), tree('src')]
+        build.Build(LEVELS, out=self.out).run()
+        build.Build(LEVELS, out=self.out, force=True).run()
+        self.assertEqual([tree('assets'), tree('src')], before)
+
+    def test_same_pixels(self):
+        build.Build(LEVELS, out=self.out).run()
+        manifest = build.read_manifest(self.out)
+        self.assertTrue(manifest)
+        for name, built in manifest['backgrounds'].items():
+            source = sim.pygame.image.load(os.path.join('assets', name))
+            made = sim.pygame.image.load(os.path.join(self.out, built))
+            self.assertEqual(pixels(made), pixels(source), name)
+
+        atlas = build.atlas(manifest, manifest['sprites'], out=self.out)
+        self.assertTrue(atlas)
+        for name in manifest['sprites']:
+            source = sim.pygame.image.load(os.path.join('assets', name))
+            region = atlas.region(name)
+            w, h = region.get_size()
+            self.assertEqual(pixels(region), pixels(source.subsurface(0, 0, w, h)), name)
+            # only see-through pixels were trimmed
+            self.assertEqual(source.get_bounding_rect().union(region.get_rect()), region.get_rect(), name)
+
+    def test_kept(self):
+        build.Build(LEVELS, out=self.out).run()
+        again = build.Build(LEVELS, out=self.out).run()
+        self.assertEqual(again['built'], [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import unittest
+
+import sim
+import main
+import level
+import solver
+
+LEVEL = os.path.join('levels', 'main.json')
+
+# the solver has to agree with the game on what the player touches first
+class TestSolver(unittest.TestCase):
+    def setUp(self):
+        sim.init()
+        self.game = main.Game(LEVEL, headless=True)
+        self.game.setup()
+        self.puzzle = solver.Puzzle(level.load(LEVEL))
+
+    def tearDown(self):
+        self.game.close()
+
+    # the object the solver says is used with the player's top left at x, y
+    def first(self, view, x, y, on):
+        for spec in self.puzzle.here.get(view, ()):
+            area = self.puzzle.shape(spec['name'], on, True)
+            if not area:
+                continue
+            mask, ax, ay = area
+            w, h = mask.get_size()
+            if 0 <= x - ax < w and 0 <= y - ay < h and mask.get_at((x - ax, y - ay)):
+                return spec['name']
+        return None
+
+    def agree(self, on):
+        game, player = self.game, self.game.player
+        for obj in game.objects:
+            if obj.type == 'toggle':
+                obj.set_anim('on' if obj.name in on else 'idle')
+        for view in sorted(self.puzzle.restr):
+            r = self.puzzle.restr[view]
+            game.world, game.loc = view
+            for cx in range(r['left'], r['right'] + 1, 11):
+                for bottom in range(r['top'], r['bot'] + 1, 11):
+                    player.rect.centerx, player.rect.bottom = cx, bottom
+                    found = game.interactions.candidates(game, player)
+                    self.assertEqual(self.first(view, player.rect.x, player.rect.y, on),
+                                     found[0].name if found else None, (view, player.rect.topleft))
+
+    def test_touches_idle(self):
+        self.agree(frozenset())
+
+    def test_touches_on(self):
+        self.agree(frozenset(self.puzzle.shapes))
+
+    # the hole's rect lies inside hipster's, but not all of its pixels
+    def test_hole_next_to_hipster(self):
+        self.assertTrue(self.puzzle.reachable('hole', (), sure=True))
+
+    def test_solvable(self):
+        self.assertTrue(solver.report(LEVEL)['solvable'])
+
+if __name__ == '__main__':
+    unittest.main()